@@ -0,0 +1,435 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from metadata_index import MetadataBitmapIndex
+from quantization import approximate_scores, quantize
+
+
+def _normalize(vectors):
+    """L2-normalize rows so that inner product equals cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _assign(vectors, centroids, block_size=8192):
+    """Assign each vector to its most similar centroid, in blocks to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _train_centroids(vectors, nlist, iterations=10, seed=0):
+    """Spherical k-means over a sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * 256)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        for list_id in range(nlist):
+            members = sample[assignments == list_id]
+            if len(members):
+                centroids[list_id] = members.sum(axis=0)
+            else:
+                # Re-seed empty lists with a random sample point
+                centroids[list_id] = sample[rng.integers(len(sample))]
+        centroids = _normalize(centroids)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest neighbour index built in NumPy.
+    Vectors are stored normalized and grouped by coarse centroid so that each
+    inverted list is a contiguous slice, which keeps memory-mapped snapshots cheap
+    to search. Namespaces smaller than brute_force_threshold are scanned exactly.
+    Centroids are retrained once the index grows past retrain_factor times the size
+    it was trained at, so the number of lists keeps up with the corpus.
+    complete is set when the index holds every vector of its namespace, which is only
+    known for indexes built from the namespace's first ingestion.
+
+    With int8 or float16 quantization, candidates are scored against compact codes
+    kept in memory and only the best top_k * rescore_factor are re-scored exactly
+    against the float32 vectors, which can then stay memory-mapped on disk.
+    """
+
+    def __init__(self, nlist=0, nprobe=8, brute_force_threshold=1000, quantization='none', rescore_factor=4,
+                 retrain_factor=4):
+        self.nlist = nlist  # 0 picks sqrt(n) lists automatically
+        self.nprobe = nprobe
+        self.brute_force_threshold = brute_force_threshold
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.retrain_factor = retrain_factor
+        self.trained_size = 0
+        self.complete = False
+        self.ids = []
+        self.metadatas = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.codes = None
+        self.scales = None
+        self.centroids = None
+        self.offsets = None
+        self._metadata_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def metadata_index(self):
+        # Every mutation replaces the metadata list, which invalidates the bitmaps
+        if self._metadata_index is None or self._metadata_index.metadatas is not self.metadatas:
+            self._metadata_index = MetadataBitmapIndex(self.metadatas)
+        return self._metadata_index
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def build(self, ids, vectors, metadatas=None):
+        """(Re)build the index from scratch"""
+        vectors = _normalize(vectors)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        self.ids = list(ids)
+        self.metadatas = metadatas
+        self.centroids = None
+        self.offsets = None
+
+        if len(vectors) < self.brute_force_threshold:
+            self.vectors = vectors
+            self.quantize()
+            return self
+
+        nlist = self.nlist or int(np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+        self.centroids = _train_centroids(vectors, nlist)
+        self.trained_size = len(vectors)
+        self._group_by_list(vectors, _assign(vectors, self.centroids))
+        return self
+
+    def quantize(self):
+        """Recompute the compact codes after the vectors changed"""
+        if self.quantization == 'none':
+            self.codes, self.scales = None, None
+        else:
+            self.codes, self.scales = quantize(self.vectors, self.quantization)
+
+    def add(self, ids, vectors, metadatas=None):
+        """Add vectors, replacing any existing entries with the same ID"""
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        new_ids = set(ids)
+        keep = [i for i, vec_id in enumerate(self.ids) if vec_id not in new_ids]
+
+        all_ids = [self.ids[i] for i in keep] + list(ids)
+        all_metadatas = [self.metadatas[i] for i in keep] + metadatas
+        new_vectors = _normalize(vectors)
+        if len(keep):
+            all_vectors = np.concatenate([np.asarray(self.vectors[keep]), new_vectors])
+        else:
+            all_vectors = new_vectors
+
+        # Train once the namespace is big enough and retrain once it has outgrown its
+        # centroids, otherwise reuse the existing centroids
+        if not self.is_trained or len(all_ids) > self.retrain_factor * self.trained_size:
+            return self.build(all_ids, all_vectors, all_metadatas)
+
+        self.ids = all_ids
+        self.metadatas = all_metadatas
+        self._group_by_list(all_vectors, _assign(all_vectors, self.centroids))
+        return self
+
+    def remove(self, ids):
+        """Remove vectors by ID, keeping the inverted lists contiguous"""
+        ids = set(ids)
+        keep = [i for i, vec_id in enumerate(self.ids) if vec_id not in ids]
+        if len(keep) == len(self.ids):
+            return self
+
+        if self.is_trained:
+            list_ids = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+            counts = np.bincount(list_ids[keep], minlength=len(self.centroids))
+            self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        self.vectors = np.ascontiguousarray(np.asarray(self.vectors)[keep])
+        if self.codes is not None:
+            self.codes = self.codes[keep]
+            self.scales = self.scales[keep] if self.scales is not None else None
+        self.ids = [self.ids[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        return self
+
+    def _group_by_list(self, vectors, assignments):
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.ids = [self.ids[i] for i in order]
+        self.metadatas = [self.metadatas[i] for i in order]
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.quantize()
+
+    def _scores(self, query, rows=None):
+        """Scores of the given rows (all rows when None), approximate if quantized"""
+        if self.codes is not None:
+            return approximate_scores(self.codes, self.scales, query, rows)
+        return self.vectors @ query if rows is None else self.vectors[rows] @ query
+
+    def search(self, query, top_k, nprobe=None, filter=None):
+        """
+        Return up to top_k (id, score, metadata) tuples ordered by similarity.
+        A Pinecone-style metadata filter restricts the candidates before scoring;
+        when few enough vectors pass it, they are scanned exactly instead of probed.
+        """
+        if not self.ids or top_k <= 0:
+            return []
+
+        query = _normalize(query)[0]
+        allowed = self.metadata_index.mask(filter) if filter else None
+        if allowed is not None and not allowed.any():
+            return []
+
+        if allowed is not None and (not self.is_trained or allowed.sum() <= self.brute_force_threshold):
+            candidates = np.flatnonzero(allowed)
+            scores = self._scores(query, candidates)
+        elif not self.is_trained:
+            candidates = np.arange(len(self.ids))
+            scores = self._scores(query)
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.concatenate([
+                np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists
+            ])
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            if not len(candidates):
+                return []
+            scores = self._scores(query, candidates)
+
+        k = min(top_k, len(candidates))
+        if self.codes is not None:
+            # Re-score a shortlist exactly, reading float32 rows in file order
+            shortlist = min(len(candidates), k * self.rescore_factor)
+            rows = np.sort(candidates[np.argpartition(-scores, shortlist - 1)[:shortlist]])
+            candidates = rows
+            scores = np.asarray(self.vectors[rows]) @ query
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            (self.ids[candidates[i]], float(scores[i]), self.metadatas[candidates[i]])
+            for i in top
+        ]
+
+    def save(self, path):
+        """Write a snapshot that can be memory-mapped by load()"""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'vectors.npy'), np.asarray(self.vectors))
+        if self.codes is not None:
+            np.save(os.path.join(tmp_path, 'codes.npy'), self.codes)
+            if self.scales is not None:
+                np.save(os.path.join(tmp_path, 'scales.npy'), self.scales)
+        if self.is_trained:
+            np.save(os.path.join(tmp_path, 'centroids.npy'), self.centroids)
+            np.save(os.path.join(tmp_path, 'offsets.npy'), self.offsets)
+        with open(os.path.join(tmp_path, 'entries.json'), 'w') as f:
+            json.dump({
+                'ids': self.ids,
+                'metadatas': self.metadatas,
+                'nlist': self.nlist,
+                'nprobe': self.nprobe,
+                'brute_force_threshold': self.brute_force_threshold,
+                'quantization': self.quantization,
+                'rescore_factor': self.rescore_factor,
+                'retrain_factor': self.retrain_factor,
+                'trained_size': self.trained_size,
+                'complete': self.complete
+            }, f)
+
+        # Swap the snapshot in place so readers never see a partial write
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'entries.json')) as f:
+            entries = json.load(f)
+
+        index = cls(
+            nlist=entries['nlist'],
+            nprobe=entries['nprobe'],
+            brute_force_threshold=entries['brute_force_threshold'],
+            quantization=entries.get('quantization', 'none'),
+            rescore_factor=entries.get('rescore_factor', 4),
+            retrain_factor=entries.get('retrain_factor', 4)
+        )
+        mmap_mode = 'r' if mmap else None
+        # Older snapshots cannot tell whether they hold the whole namespace
+        index.complete = entries.get('complete', False)
+        index.ids = entries['ids']
+        index.metadatas = entries['metadatas']
+        index.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmap_mode)
+
+        # Codes are read into memory since every query scans them; the vectors stay mapped
+        codes_path = os.path.join(path, 'codes.npy')
+        if os.path.exists(codes_path):
+            index.codes = np.load(codes_path)
+            scales_path = os.path.join(path, 'scales.npy')
+            index.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+
+        centroids_path = os.path.join(path, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+            index.offsets = np.load(os.path.join(path, 'offsets.npy'))
+            # Older snapshots did not record it; sqrt(n) lists means roughly nlist ** 2 vectors
+            index.trained_size = entries.get('trained_size', len(index.centroids) ** 2)
+        return index
+
+
+class AnnIndexStore:
+    """
+    Keeps one IVFIndex per Pinecone namespace, persisted under snapshot_dir.
+    Ingestion stages the vectors of each wave and commits them once per run, so the
+    index is rebuilt and written once instead of after every wave. An index only
+    serves queries once it is complete; see commit().
+    """
+
+    def __init__(self, snapshot_dir, nlist=0, nprobe=8, brute_force_threshold=1000,
+                 quantization='none', rescore_factor=4, retrain_factor=4):
+        self.snapshot_dir = snapshot_dir
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.brute_force_threshold = brute_force_threshold
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.retrain_factor = retrain_factor
+        self._indexes = {}
+        self._staged = {}
+        self._lock = threading.Lock()
+
+    def _path(self, namespace):
+        return os.path.join(self.snapshot_dir, namespace)
+
+    def load_all(self):
+        """Load every snapshot found on disk, returning the number of namespaces loaded"""
+        if not os.path.isdir(self.snapshot_dir):
+            return 0
+        loaded = 0
+        for namespace in os.listdir(self.snapshot_dir):
+            path = self._path(namespace)
+            if namespace.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                index = IVFIndex.load(path)
+                index.nprobe = self.nprobe
+                index.rescore_factor = self.rescore_factor
+                index.retrain_factor = self.retrain_factor
+                if index.quantization != self.quantization:
+                    index.quantization = self.quantization
+                    index.quantize()
+                with self._lock:
+                    self._indexes[namespace] = index
+                loaded += 1
+            except Exception as e:
+                print(f"Error loading ANN snapshot {namespace}: {e}")
+        return loaded
+
+    def get(self, namespace):
+        with self._lock:
+            return self._indexes.get(namespace)
+
+    def _empty(self):
+        return IVFIndex(self.nlist, self.nprobe, self.brute_force_threshold, self.quantization, self.rescore_factor,
+                        self.retrain_factor)
+
+    def _copy(self, namespace):
+        """Copy a namespace's index so concurrent queries keep using the previous one"""
+        with self._lock:
+            current = self._indexes.get(namespace)
+
+        index = self._empty()
+        if current is not None:
+            index.complete = current.complete
+            index.ids = list(current.ids)
+            index.metadatas = list(current.metadatas)
+            index.vectors = np.asarray(current.vectors)
+            index.codes = current.codes
+            index.scales = current.scales
+            index.centroids = current.centroids
+            index.offsets = current.offsets
+            index.trained_size = current.trained_size
+        return index
+
+    def _publish(self, namespace, index):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        index.save(self._path(namespace))
+        if index.codes is not None:
+            # Queries only need a few float32 rows for re-scoring, so serve them from the snapshot
+            index.vectors = np.load(os.path.join(self._path(namespace), 'vectors.npy'), mmap_mode='r')
+        with self._lock:
+            self._indexes[namespace] = index
+
+    def add(self, namespace, vectors, complete=False):
+        """Add Pinecone-formatted vectors to a namespace and persist a new snapshot"""
+        self.stage(namespace, vectors)
+        self.commit(namespace, complete)
+
+    def stage(self, namespace, vectors):
+        """Hold Pinecone-formatted vectors until the namespace is next committed"""
+        if not vectors:
+            return
+        ids = [vector['id'] for vector in vectors]
+        values = np.asarray([vector['values'] for vector in vectors], dtype=np.float32)
+        metadatas = [dict(vector.get('metadata') or {}) for vector in vectors]
+        with self._lock:
+            self._staged.setdefault(namespace, []).append((ids, values, metadatas))
+
+    def commit(self, namespace, complete=False):
+        """
+        Add every staged vector of a namespace in one rebuild and persist a new snapshot.
+        Pass complete when the staged vectors are everything the namespace holds, as in
+        its first ingestion; the index is then rebuilt from them alone and marked
+        complete. Otherwise they extend the current index, which stays as complete as
+        it was, so a namespace first indexed by an incremental update is never served.
+        """
+        with self._lock:
+            staged = self._staged.pop(namespace, [])
+        if not staged:
+            return
+
+        index = self._empty() if complete else self._copy(namespace)
+        index.complete = index.complete or complete
+        index.add(
+            [vec_id for ids, _, _ in staged for vec_id in ids],
+            np.concatenate([values for _, values, _ in staged]),
+            [metadata for _, _, metadatas in staged for metadata in metadatas]
+        )
+        self._publish(namespace, index)
+
+    def remove(self, namespace, ids):
+        if self.get(namespace) is None:
+            return
+        index = self._copy(namespace)
+        index.remove(ids)
+        self._publish(namespace, index)
+
+    def drop(self, namespace):
+        with self._lock:
+            self._indexes.pop(namespace, None)
+            self._staged.pop(namespace, None)
+        shutil.rmtree(self._path(namespace), ignore_errors=True)
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Per-company cache of generated answers keyed by query embedding.
+    A lookup hits when a cached query with the same key parameters has cosine
+    similarity of at least threshold with the new one and was answered against
+    the company's current corpus version. Ingestion bumps the version, which
+    makes every earlier answer for that company unreachable.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=256, ttl=86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = defaultdict(list)  # company_id -> [entry]
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def version(self, company_id):
+        with self._lock:
+            return self._versions[company_id]
+
+    def invalidate(self, company_id):
+        """Start a new corpus version and drop the company's cached answers"""
+        with self._lock:
+            self._versions[company_id] += 1
+            self._entries.pop(company_id, None)
+
+    def lookup(self, company_id, embedding, key=None):
+        """Return the cached response for a similar query, or None"""
+        query = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            version = self._versions[company_id]
+            entries = [
+                entry for entry in self._entries.get(company_id, [])
+                if entry['version'] == version and now - entry['created'] < self.ttl
+            ]
+            self._entries[company_id] = entries
+
+            best = None
+            best_score = self.threshold
+            for entry in entries:
+                if entry['key'] != key:
+                    continue
+                score = float(entry['embedding'] @ query)
+                if score >= best_score:
+                    best, best_score = entry, score
+
+            if best is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.saved_seconds += best['seconds']
+            best['last_used'] = now
+            return best['response']
+
+    def store(self, company_id, embedding, response, seconds, key=None, version=None):
+        """
+        Cache a response that took seconds to produce. Pass the version read before
+        answering so an ingestion that finished in the meantime discards the answer.
+        """
+        now = time.time()
+        with self._lock:
+            current = self._versions[company_id]
+            if version is not None and version != current:
+                return
+            entries = self._entries[company_id]
+            entries.append({
+                'embedding': self._normalize(embedding),
+                'response': response,
+                'seconds': seconds,
+                'key': key,
+                'version': current,
+                'created': now,
+                'last_used': now
+            })
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda entry: entry['last_used'])
+                del entries[:len(entries) - self.max_entries]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'entries': sum(len(entries) for entries in self._entries.values())
+            }
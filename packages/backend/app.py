@@ -1,20 +1,25 @@
-from flask import Flask, request, jsonify
-from sentence_transformers import SentenceTransformer
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from sklearn.metrics.pairwise import cosine_similarity
+import time
+startup_started = time.time()
+
+import importlib.machinery
+# Spawned PDF workers only need pdf_extract. Giving the script a module spec stops
+# multiprocessing from re-running this whole file in every worker
+if __name__ == '__main__' and __spec__ is None:
+    __spec__ = importlib.machinery.ModuleSpec('__main__', None)
+
+from flask import Flask, request, jsonify, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pinecone.grpc import PineconeGRPC as Pinecone
 import google.generativeai as genai
 import numpy as np
 import nltk
 import os
 from googleapiclient.discovery import build
-import csv
 from dotenv import load_dotenv
 from flask_cors import CORS
-import PyPDF2
-import easyocr
+from pdf_extract import count_pdf_pages, submit_pdf_pages
+from blob_io import BlobIOStats, fetch_blob
 from PIL import Image
-import whisper
 from moviepy import VideoFileClip
 import glob
 from pydub import AudioSegment
@@ -25,6 +30,30 @@ from firebase_admin import firestore, credentials
 from collections import defaultdict
 from firebase_admin import storage
 import json
+import base64
+import io
+import multiprocessing
+import queue
+import threading
+from retrieval import create_retriever, reciprocal_rank_fusion
+from ann_index import AnnIndexStore
+from lexical_index import LexicalIndexStore
+from metadata_index import validate_filter
+from embedding_cache import EmbeddingCache
+from manifest import IngestionManifest
+from jobs import JobManager
+from model_registry import ModelRegistry, resident_memory_mb
+from doc_cache import DocumentCache
+from chunk_store import ChunkStoreRegistry, valid_company_id
+from answer_cache import SemanticAnswerCache
+from llm import FakeStreamingLLM
+from context_packer import ContextPacker
+from dedup import ChunkDeduplicator
+from chunker import TokenChunker, tokenizer_offsets, whitespace_offsets
+from record_stream import IngestionCheckpoint, iter_record_batches, parse_column_map
+from batch_writer import FirestoreBatchWriter, VectorUpsertWriter
+from ocr_worker import BatchedOcrWorker, OcrCache, OcrStats
+import hashlib
 
 
 # Initialize Firebase Admin SDK with both Firestore and Storage
@@ -49,257 +78,363 @@ CORS(app)
 # Initialize configurations
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')  # gemini, or fake for offline testing
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'pinecone')  # pinecone, local or ann
+DEFAULT_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 15))
+MAX_TOP_K = int(os.getenv('RETRIEVAL_MAX_TOP_K', 100))
+ANN_SNAPSHOT_DIR = os.getenv('ANN_SNAPSHOT_DIR', 'data/ann')
+ANN_NLIST = int(os.getenv('ANN_NLIST', 0))  # 0 = sqrt(number of vectors)
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', 8))  # More lists probed = higher recall, slower queries
+ANN_MIN_VECTORS = int(os.getenv('ANN_MIN_VECTORS', 1000))  # Smaller namespaces are scanned exactly
+ANN_QUANTIZATION = os.getenv('ANN_QUANTIZATION', 'int8')  # int8, float16 or none; vectors kept in memory for scoring
+ANN_RESCORE_FACTOR = int(os.getenv('ANN_RESCORE_FACTOR', 4))  # Shortlist of top_k * factor re-scored in float32
+ANN_RETRAIN_FACTOR = int(os.getenv('ANN_RETRAIN_FACTOR', 4))  # Retrain centroids after growing this many times over
+LEXICAL_INDEX_DIR = os.getenv('LEXICAL_INDEX_DIR', 'data/lexical')  # Empty disables BM25 hybrid retrieval
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 2))  # Candidates taken from each ranker, as a multiple of top_k
+RRF_K = int(os.getenv('RRF_K', 60))  # Reciprocal rank fusion constant
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))  # Chunks encoded per model call
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'data/embedding_cache.sqlite3')  # Empty disables the cache
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 500000))
+EMAIL_DATA_PATH = os.getenv('EMAIL_DATA_PATH', 'data.csv')  # CSV, or JSONL with a .jsonl extension
+EMAIL_COLUMN_MAP = parse_column_map(os.getenv('EMAIL_COLUMN_MAP'))  # e.g. {"label": "v1", "message": "v2"}
+EMAIL_ENCODING = os.getenv('EMAIL_ENCODING') or None  # Unset reads JSONL as UTF-8 and CSV as ISO-8859-1
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 500))  # Rows embedded and stored per checkpoint
+INGESTION_CHECKPOINT_DIR = os.getenv('INGESTION_CHECKPOINT_DIR', 'data/checkpoints')
+INGESTION_JOBS_DIR = os.getenv('INGESTION_JOBS_DIR', 'data/jobs')
+INGESTION_MAX_CONCURRENCY = int(os.getenv('INGESTION_MAX_CONCURRENCY', 2))  # Companies ingested at once
+INGEST_WAVE_SIZE = int(os.getenv('INGEST_WAVE_SIZE', 256))  # Extracted texts embedded together
+UPSERT_BATCH_SIZE = int(os.getenv('UPSERT_BATCH_SIZE', 100))  # Vectors per upsert request
+UPSERT_WORKERS = int(os.getenv('UPSERT_WORKERS', 4))  # Upsert requests in flight at once
+UPSERT_MAX_RETRIES = int(os.getenv('UPSERT_MAX_RETRIES', 5))
+FIRESTORE_BATCH_SIZE = int(os.getenv('FIRESTORE_BATCH_SIZE', 500))  # Operations per commit, 500 at most
+FIRESTORE_WRITERS = int(os.getenv('FIRESTORE_WRITERS', 4))  # Batch commits in flight at once
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 50000))  # IDs deleted per index update for changed sources
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', 0))  # 0 = the embedding model's window minus the label
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 32))  # Tokens shared by consecutive chunks
+EMAIL_CHUNK_TOKENS = int(os.getenv('EMAIL_CHUNK_TOKENS', 64))  # Smaller chunks keep email labels accurate
+LABEL_RESERVED_TOKENS = int(os.getenv('LABEL_RESERVED_TOKENS', 16))  # Room for the label appended by label_chunk
+CHUNK_DEDUP_THRESHOLD = float(os.getenv('CHUNK_DEDUP_THRESHOLD', 0.9))  # Estimated Jaccard of near-duplicate chunks, 0 disables
+EXTRACT_DOWNLOAD_WORKERS = int(os.getenv('EXTRACT_DOWNLOAD_WORKERS', 8))
+EXTRACT_PDF_WORKERS = int(os.getenv('EXTRACT_PDF_WORKERS', os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 16))  # Pages parsed per process pool task
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', 8))  # Images read together by the OCR worker
+OCR_BATCH_WAIT_MS = int(os.getenv('OCR_BATCH_WAIT_MS', 50))  # Wait for more images before running a partial batch
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', 1600))  # Pixels on the longer side after downscaling, 0 = full resolution
+OCR_RECOGNIZE_BATCH_SIZE = int(os.getenv('OCR_RECOGNIZE_BATCH_SIZE', 32))  # Text boxes per recognizer call
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH', 'data/ocr_cache.sqlite3')  # Empty disables the cache
+OCR_CACHE_MAX_ENTRIES = int(os.getenv('OCR_CACHE_MAX_ENTRIES', 100000))
+LISTING_CACHE_TTL = int(os.getenv('LISTING_CACHE_TTL', 60))  # Seconds a bucket listing is reused
+BLOB_SPILL_THRESHOLD = int(os.getenv('BLOB_SPILL_THRESHOLD', 64 * 1024 * 1024))  # Larger blobs go to a temp file
+BACKEND_ROLE = os.getenv('BACKEND_ROLE', 'all')  # query, ingestion or all
+MODEL_IDLE_TIMEOUT = int(os.getenv('MODEL_IDLE_TIMEOUT', 0))  # Seconds before an unused model is unloaded, 0 = never
+MODEL_PRELOAD = os.getenv('MODEL_PRELOAD', 'false').lower() == 'true'  # Load the role's models at startup
+DOCUMENT_CACHE_SIZE = int(os.getenv('DOCUMENT_CACHE_SIZE', 10000))  # Chunk documents kept in memory
+CHUNK_STORE_DIR = os.getenv('CHUNK_STORE_DIR', 'data/chunks')  # Empty disables the local chunk store
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))  # Cosine similarity for a cache hit
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 256))  # Answers kept per company
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 86400))  # Seconds
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))  # Prompt tokens spent on retrieved contexts
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', 0.85))  # Shingle overlap treated as duplicate
 
 # Initialize services
 pc = Pinecone(api_key=PINECONE_API_KEY, service_name='cosine-similarity')
 index = pc.Index("cusat")
 
+# Initialize the local ANN indexes, reloading any snapshots from a previous run
+ann_store = None
+if RETRIEVAL_BACKEND == 'ann':
+    ann_store = AnnIndexStore(
+        ANN_SNAPSHOT_DIR, ANN_NLIST, ANN_NPROBE, ANN_MIN_VECTORS, ANN_QUANTIZATION, ANN_RESCORE_FACTOR,
+        ANN_RETRAIN_FACTOR
+    )
+    print(f"Loaded {ann_store.load_all()} ANN index snapshots from {ANN_SNAPSHOT_DIR}")
+
+retriever = create_retriever(RETRIEVAL_BACKEND, index, ann_store)
+
+# Initialize the per-company BM25 indexes used alongside vector retrieval
+lexical_store = None
+if LEXICAL_INDEX_DIR:
+    lexical_store = LexicalIndexStore(LEXICAL_INDEX_DIR)
+    print(f"Loaded {lexical_store.load_all()} lexical indexes from {LEXICAL_INDEX_DIR}")
+
 # Initialize Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel("gemini-1.5-flash")
+if LLM_BACKEND == 'fake':
+    gemini_model = FakeStreamingLLM()
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
+    gemini_model = genai.GenerativeModel("gemini-1.5-flash")
+
+# Models are loaded on first use; the role decides which ones this process may load
+def load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+def load_ocr_reader():
+    import easyocr
+    return easyocr.Reader(['en'])
+
+def load_whisper_model():
+    import whisper
+    return whisper.load_model("base")
+
+models = ModelRegistry(BACKEND_ROLE, MODEL_IDLE_TIMEOUT)
+models.register('embedding', load_embedding_model, roles=('query', 'ingestion'))
+models.register('ocr', load_ocr_reader, roles=('ingestion',))
+models.register('whisper', load_whisper_model, roles=('ingestion',))
+models.start_reaper()
 
-# Initialize Sentence Transformer
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Initialize the embedding cache so unchanged chunks are never re-encoded
+embedding_cache = None
+if EMBEDDING_CACHE_PATH:
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_MAX_ENTRIES)
 
-# Initialize EasyOCR reader for image text extraction
-reader = easyocr.Reader(['en'])
+# Cache of chunk documents used to build query contexts
+document_cache = DocumentCache(DOCUMENT_CACHE_SIZE)
 
-# Initialize Whisper model
-whisper_model = whisper.load_model("base")
+# Local chunk text stores, with Firestore kept as the durable copy
+chunk_stores = ChunkStoreRegistry(CHUNK_STORE_DIR) if CHUNK_STORE_DIR else None
+
+# Cache of generated answers keyed by query embedding
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+
+# Packs retrieved contexts into the Gemini prompt token budget
+context_packer = ContextPacker(CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
 
 # Store recent queries by company ID
 company_queries = defaultdict(list)
 
+# Extraction pipeline: downloads on an I/O pool, PDF parsing on a process pool,
+# and one dedicated worker per model so OCR and Whisper never compete with themselves
+download_pool = ThreadPoolExecutor(max_workers=EXTRACT_DOWNLOAD_WORKERS, thread_name_prefix='download')
+ocr_worker = BatchedOcrWorker(
+    lambda: models.get('ocr'), OCR_BATCH_SIZE, OCR_BATCH_WAIT_MS / 1000, OCR_MAX_SIDE, OCR_RECOGNIZE_BATCH_SIZE,
+    OcrCache(OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES) if OCR_CACHE_PATH and models.allowed('ocr') else None
+)
+whisper_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='whisper')
+pdf_pool = None
+pdf_pool_lock = threading.Lock()
+
+# Recent bucket listings by (company ID, prefix)
+listing_cache = {}
+listing_cache_lock = threading.Lock()
+
+# Background ingestion jobs
+ingestion_jobs = JobManager(INGESTION_JOBS_DIR, INGESTION_MAX_CONCURRENCY)
+
 # At the top of the file with other global variables
 global_bucket = None  # Initialize global bucket variable
 
-def safe_filename(filename):
-    """Convert filename to a safe version without spaces and special characters"""
-    return "".join(c for c in filename if c.isalnum() or c in '._-')
-
 def ensure_temp_dir():
     """Ensure temporary directory exists"""
     temp_dir = '/tmp/firebase_files'
     os.makedirs(temp_dir, exist_ok=True)
     return temp_dir
 
-def get_files_with_bucket(bucket_instance):
+def classify_blob(name):
+    """Return the file type of a blob based on its name"""
+    filename = name.lower()
+    if filename.endswith(('.pdf')):
+        return 'pdf'
+    elif filename.endswith(('.jpg', '.jpeg', '.png')):
+        return 'image'
+    elif filename.endswith(('.mp3', '.wav')):
+        return 'audio'
+    elif filename.endswith(('.mp4')):
+        return 'video'
+    return 'other'
+
+def get_files_with_bucket(bucket_instance, prefix=None):
+    """List the bucket once and classify every blob by type"""
     files_by_type = {
         'pdf': [],
         'image': [],
         'audio': [],
-        'video': []
+        'video': [],
+        'other': []
     }
     
-    blobs = bucket_instance.list_blobs()
+    blobs = bucket_instance.list_blobs(prefix=prefix)
     for blob in blobs:
-        filename = blob.name.lower()
-        if filename.endswith(('.pdf')):
-            files_by_type['pdf'].append(blob)
-        elif filename.endswith(('.jpg', '.jpeg', '.png')):
-            files_by_type['image'].append(blob)
-        elif filename.endswith(('.mp3', '.wav')):
-            files_by_type['audio'].append(blob)
-        elif filename.endswith(('.mp4')):
-            files_by_type['video'].append(blob)
+        files_by_type[classify_blob(blob.name)].append(blob)
     
     return files_by_type
 
-def clean_text(text):
-    """Clean extracted text by removing excessive whitespace and newlines."""
-    if not text:
-        return ""
-        
-    # Replace multiple newlines and spaces with a single space
-    text = ' '.join(text.split())
-    
-    # Fix common PDF extraction artifacts
-    text = text.replace(' ,', ',')
-    text = text.replace(' .', '.')
-    text = text.replace(' :', ':')
-    text = text.replace('●', '\n•')  # Convert bullets to cleaner format
-    
-    # Fix spacing after punctuation
-    for punct in ['.', ',', '!', '?', ':', ';']:
-        text = text.replace(f'{punct} ', f'{punct} ')
-    
-    # Remove any remaining control characters
-    text = ''.join(char for char in text if char.isprintable() or char in ['\n'])
-    
-    return text.strip()
-
-def extract_text_from_pdf(bucket):
-    pdf_texts = []
-    files = get_files_with_bucket(bucket)['pdf']
-    temp_dir = ensure_temp_dir()
-    
-    for blob in files:
-        try:
-            # Create safe filename and full path
-            safe_name = safe_filename(blob.name)
-            temp_path = os.path.join(temp_dir, safe_name)
-            
-            # Download file to temporary storage
-            blob.download_to_filename(temp_path)
-            print(f"Downloaded file to: {temp_path}")
-            
-            with open(temp_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                pages_text = []
-                
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        cleaned_text = clean_text(page_text)
-                        if cleaned_text:
-                            pages_text.append(cleaned_text)
-                
-                if pages_text:
-                    final_text = '\n\n'.join(pages_text)
-                    pdf_texts.append({
-                        'type': 'pdf',
-                        'source': blob.name,
-                        'content': final_text
-                    })
-                    print(f"Successfully processed {blob.name}")
-            
-            # Clean up temporary file
-            os.remove(temp_path)
-            
-        except Exception as e:
-            print(f"Error processing PDF {blob.name}: {e}")
-            import traceback
-            print(traceback.format_exc())
+def get_company_files(company_id, bucket_instance, prefix=None, max_age=LISTING_CACHE_TTL):
+    """
+    Return the classified listing of a company bucket, reusing a cached listing
+    younger than max_age seconds. Pass max_age=0 to force a fresh listing.
+    """
+    key = (company_id, prefix or '')
+    now = time.time()
+    with listing_cache_lock:
+        cached = listing_cache.get(key)
+    if cached and now - cached[0] < max_age:
+        return cached[1]
     
-    return pdf_texts
+    files = get_files_with_bucket(bucket_instance, prefix)
+    with listing_cache_lock:
+        listing_cache[key] = (now, files)
+    return files
+
+def filter_files(files, names):
+    """Keep only the blobs whose names are in names"""
+    return {
+        file_type: [blob for blob in blobs if blob.name in names]
+        for file_type, blobs in files.items()
+    }
 
-def extract_text_from_images(bucket):
-    image_texts = []
-    files = get_files_with_bucket(bucket)['image']
-    temp_dir = ensure_temp_dir()
+def load_audio_samples(payload, stats=None):
+    """
+    Decode audio into the 16 kHz mono float32 samples Whisper expects,
+    straight from memory instead of exporting an intermediate WAV file.
+    """
+    source = io.BytesIO(payload.data) if payload.data is not None else payload.path
+    audio = AudioSegment.from_file(source, format=payload.extension)
+    audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    if stats and payload.extension == 'mp3':
+        stats.record_wav_avoided(len(audio.raw_data))
+    return np.array(audio.get_array_of_samples()).astype(np.float32) / 32768.0
+
+def extract_text_from_audio_file(samples):
+    """Transcribe decoded audio samples with Whisper"""
+    return models.get('whisper').transcribe(samples, fp16=False)["text"]
+
+def get_pdf_pool():
+    """
+    Create the PDF process pool on first use so query-only processes never start it.
+    Workers are spawned rather than forked, since this process already runs download,
+    gRPC, OCR and Flask threads whose locks a fork could copy while held.
+    """
+    global pdf_pool
+    with pdf_pool_lock:
+        if pdf_pool is None:
+            pdf_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_PDF_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return pdf_pool
+
+def submit_pdf_extraction(stage_input):
+    """Spread the pages of a PDF across the process pool"""
+    source, page_count = stage_input
+    return submit_pdf_pages(get_pdf_pool(), source, page_count, PDF_PAGES_PER_TASK)
+
+# Extraction stage for each blob type, submitting its input and returning a future
+EXTRACTION_STAGES = {
+    'pdf': submit_pdf_extraction,
+    'image': ocr_worker.submit,
+    'audio': lambda samples: whisper_worker.submit(extract_text_from_audio_file, samples)
+}
+
+def download_and_prepare(file_type, blob, io_stats, ocr_stats=None):
+    """Download a blob and turn it into the input of its extraction stage"""
+    payload = fetch_blob(blob, BLOB_SPILL_THRESHOLD, ensure_temp_dir(), io_stats)
+    try:
+        if file_type == 'audio':
+            # Decoding happens on the I/O pool so the Whisper worker only transcribes
+            with payload:
+                return payload, load_audio_samples(payload, io_stats)
+        if file_type == 'pdf':
+            # Only the page tree is read here; the pages are parsed on the process pool
+            page_count = count_pdf_pages(payload.source)
+            if page_count > PDF_PAGES_PER_TASK:
+                # Several tasks read this PDF, so hand them a path instead of pickling the bytes into each
+                payload.spill(ensure_temp_dir())
+            return payload, (payload.source, page_count)
+        if file_type == 'image':
+            # Hashing, decoding and downscaling run here so the OCR worker only reads text
+            return payload, ocr_worker.prepare(payload.source, ocr_stats)
+        return payload, payload.source
+    except Exception:
+        # Remove a spilled temporary file before the error reaches the pipeline
+        payload.close()
+        raise
+
+def iter_extracted_files(files, io_stats=None, ocr_stats=None):
+    """
+    Extract text from classified blobs as a pipeline: downloads run on the I/O pool,
+    PDF pages on the process pool and OCR/Whisper on their dedicated model workers.
+    Blobs are handed to the parsers from memory, spilling to disk only when large.
+    Yields (file_type, blob, entry, error) as each blob finishes; entry is None when no
+    text was found or extraction failed, and error is the exception of a failed blob.
+    PDF entries also carry their (page number, text) pairs under 'pages'.
+    """
+    results = queue.Queue()
     
-    for blob in files:
+    def on_extracted(file_type, blob, payload, future):
+        entry = None
+        error = None
         try:
-            # Create safe filename and full path
-            safe_name = safe_filename(blob.name)
-            temp_path = os.path.join(temp_dir, safe_name)
-            
-            # Download file to temporary storage
-            blob.download_to_filename(temp_path)
-            print(f"Downloaded file to: {temp_path}")
-            
-            # Perform OCR
-            results = reader.readtext(temp_path)
-            text = ' '.join([result[1] for result in results])
-            
-            if text.strip():
-                image_texts.append({
-                    'type': 'image',
+            result = future.result()
+            pages = result if file_type == 'pdf' else None
+            text = '\n\n'.join(page_text for _, page_text in pages) if pages is not None else result
+            if text and text.strip():
+                entry = {
+                    'type': file_type,
                     'source': blob.name,
                     'content': text
-                })
+                }
+                if pages is not None:
+                    entry['pages'] = pages
                 print(f"Successfully extracted text from {blob.name}")
-            
-            # Clean up temporary file
-            os.remove(temp_path)
-            
         except Exception as e:
-            print(f"Error processing image {blob.name}: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
-    
-    return image_texts
-
-def extract_text_from_audio(bucket):
-    audio_texts = []
-    files = get_files_with_bucket(bucket)['audio']
-    temp_dir = ensure_temp_dir()
+            print(f"Error processing {file_type} {blob.name}: {e}")
+            error = e
+        finally:
+            # Clean up any spilled temporary file
+            payload.close()
+        results.put((file_type, blob, entry, error))
     
-    for blob in files:
+    def on_downloaded(file_type, blob, future):
+        payload = None
         try:
-            # Create safe filename and full path
-            safe_name = safe_filename(blob.name)
-            temp_path = os.path.join(temp_dir, safe_name)
-            
-            # Download file to temporary storage
-            blob.download_to_filename(temp_path)
-            print(f"Downloaded file to: {temp_path}")
-            
-            # Convert mp3 to wav if necessary
-            if temp_path.lower().endswith('.mp3'):
-                audio = AudioSegment.from_mp3(temp_path)
-                wav_path = temp_path.rsplit('.', 1)[0] + '.wav'
-                audio.export(wav_path, format='wav')
-                os.remove(temp_path)  # Remove original mp3
-                temp_path = wav_path
-
-            # Use Whisper for transcription
-            result = whisper_model.transcribe(temp_path, fp16=False)
-            text = result["text"]
-            
-            if text.strip():
-                audio_texts.append({
-                    'type': 'audio',
-                    'source': blob.name,
-                    'content': text
-                })
-                print(f"Successfully extracted text from {blob.name}")
-            
-            # Clean up temporary file
-            os.remove(temp_path)
-            
+            payload, stage_input = future.result()
+            stage = EXTRACTION_STAGES[file_type](stage_input)
+            stage.add_done_callback(lambda f: on_extracted(file_type, blob, payload, f))
         except Exception as e:
-            print(f"Error processing audio {blob.name}: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
+            print(f"Error downloading {file_type} {blob.name}: {e}")
+            if payload is not None:
+                payload.close()
+            results.put((file_type, blob, None, e))
     
-    return audio_texts
+    pending = 0
+    for file_type in EXTRACTION_STAGES:
+        for blob in files.get(file_type, []):
+            download = download_pool.submit(download_and_prepare, file_type, blob, io_stats, ocr_stats)
+            download.add_done_callback(lambda f, t=file_type, b=blob: on_downloaded(t, b, f))
+            pending += 1
+    
+    while pending:
+        yield results.get()
+        pending -= 1
 
 # Helper Functions for Data Lake
-def fetch_email_data():
-    csv_data = []
-    try:
-        with open('data.csv', 'r', encoding='ISO-8859-1') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)  # Skip header row
-            for i, row in enumerate(csv_reader):
-                if i >= 100:  # Stop after 100 rows
-                    break
-                if not row or len(row) < 2:  # Skip empty rows
-                    continue
-                csv_data.append({
-                    'label': row[0].strip().lower(),  # spam/nonspam
-                    'message': row[1].strip()  # message content
-                })
-            print(f"Processed {len(csv_data)} email entries (limited to first 100)")
-    except Exception as e:
-        print(f"Error reading CSV: {e}")
-    return csv_data
+# Keys used for each blob type in collected data
+DATA_KEYS = {'pdf': 'pdfs', 'image': 'images', 'audio': 'audio'}
 
-def collect_data(bucket):
+def iter_collected_data(files, names=None, job=None, io_stats=None, failed=None, ocr_stats=None):
+    """
+    Stream collected blob data from a classified bucket listing as (source, entries)
+    pairs in the order extraction finishes. Only the named sources are collected when
+    names is given. Email records are streamed separately by ingest_email_source.
+    The names of blobs that failed or were never extracted are added to failed.
+    """
+    if names is not None:
+        files = filter_files(files, names)
+    unfinished = {blob.name for file_type in EXTRACTION_STAGES for blob in files.get(file_type, [])}
     try:
-        data = {}
-        
-        # Collect and validate data from each source
-        sources = {
-            'emails': fetch_email_data,
-            'pdfs': lambda: extract_text_from_pdf(bucket),
-            'images': lambda: extract_text_from_images(bucket),
-            'audio': lambda: extract_text_from_audio(bucket)
-        }
-        
-        for source, fetcher in sources.items():
-            try:
-                result = fetcher()
-                if result:  # Only add non-empty results
-                    data[source] = result
-            except Exception as e:
-                print(f"Error collecting {source} data: {e}")
-                
-        return data if data else None
+        for file_type, blob, entry, error in iter_extracted_files(files, io_stats, ocr_stats):
+            unfinished.discard(blob.name)
+            if job:
+                job.advance('blobs_extracted')
+            if error is not None and failed is not None:
+                failed.add(blob.name)
+            if entry:
+                yield DATA_KEYS[file_type], [entry]
     except Exception as e:
-        print(f"Error collecting data: {e}")
-        return None
+        print(f"Error collecting file data: {e}")
+        if failed is not None:
+            failed.update(unfinished)
 
 
 # Helper Functions for Embeddings
@@ -330,6 +465,8 @@ def extract_text_from_data(data):
                 source='email',
                 metadata={
                     'label': entry['label'],  # spam/nonspam
+                    'filename': EMAIL_DATA_PATH,
+                    'row': entry.get('row'),
                     'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 }
             )
@@ -346,13 +483,26 @@ def extract_text_from_data(data):
                 }
             )
 
-    # Process document sources (PDF, audio, video)
-    for source_type in ['pdfs', 'audio', 'video']:
+    # Process PDFs page by page so chunks keep their page numbers
+    if 'pdfs' in data:
+        for entry in data['pdfs']:
+            pages = entry.get('pages') or [(None, entry.get('content', ''))]
+            for page_number, page_text in pages:
+                metadata = {
+                    'filename': entry.get('source'),
+                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }
+                if page_number is not None:
+                    metadata['page'] = page_number
+                add_text(text=page_text, source='pdf', metadata=metadata)
+
+    # Process other document sources (audio, video)
+    for source_type, source in [('audio', 'audio'), ('video', 'video')]:
         if source_type in data:
             for entry in data[source_type]:
                 add_text(
                     text=entry.get('content', ''),
-                    source=source_type[:-1],  # Remove 's' to get singular form
+                    source=source,
                     metadata={
                         'filename': entry.get('source'),
                         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -361,151 +511,221 @@ def extract_text_from_data(data):
 
     return structured_texts
 
-def chunk_text(texts, max_chunk_size=512, overlap=50):
+def create_chunker():
+    """Chunker counting tokens with the embedding model's own tokenizer"""
+    model = models.get('embedding')
+    tokenizer = getattr(model, 'tokenizer', None)
+    offsets = tokenizer_offsets(tokenizer) if getattr(tokenizer, 'is_fast', False) else whitespace_offsets
+    # Leave room for the special tokens and the label appended by label_chunk
+    max_tokens = CHUNK_MAX_TOKENS or (getattr(model, 'max_seq_length', None) or 256) - 2 - LABEL_RESERVED_TOKENS
+    return TokenChunker(offsets, max_tokens, min(CHUNK_OVERLAP_TOKENS, max_tokens // 2))
+
+def chunk_text(texts, chunker=None):
     """
-    Split text entries into smaller chunks while preserving metadata.
+    Split text entries into chunks that fit the embedding model's window while preserving metadata.
     Args:
         texts: List of dictionaries containing text, source, and metadata
-        max_chunk_size: Maximum number of characters per chunk
-        overlap: Number of characters to overlap between chunks for context preservation
+        chunker: Optional TokenChunker; by default one is built from the embedding model
     """
+    chunker = chunker or create_chunker()
+    entries = [entry for entry in texts if entry['text'].strip()]  # Skip empty texts
     chunked_texts = []
     
-    for entry in texts:
-        text = entry['text']
-        # Skip empty texts
-        if not text.strip():
+    # For email data, keep chunks smaller to maintain label accuracy
+    for is_email in (False, True):
+        group = [entry for entry in entries if (entry['source'] == 'email') == is_email]
+        if not group:
             continue
-            
-        # For email data, keep chunks smaller to maintain label accuracy
-        current_max_size = max_chunk_size
-        if entry['source'] == 'email':
-            current_max_size = 256  # Smaller chunks for emails to maintain label accuracy
-            
-        # Split text into words
-        words = text.split()
-        current_chunk = []
-        current_length = 0
-        
-        for word in words:
-            word_length = len(word) + 1  # +1 for space
-            
-            # If adding this word would exceed max_chunk_size, save current chunk and start new one
-            if current_length + word_length > current_max_size and current_chunk:
-                # Join words and add metadata
-                chunk_text = ' '.join(current_chunk)
+        max_tokens = min(EMAIL_CHUNK_TOKENS, chunker.max_tokens) if is_email else None
+        for entry, chunks in zip(group, chunker.split([entry['text'] for entry in group], max_tokens)):
+            for position, chunk in enumerate(chunks):
                 chunked_texts.append({
-                    'text': chunk_text,
+                    'text': chunk,
                     'source': entry['source'],
+                    'position': position,  # Index of the chunk within its text entry
                     'metadata': entry['metadata'].copy()  # Make a copy to avoid reference issues
                 })
-                
-                # Start new chunk with overlap by keeping some words for context
-                overlap_words = current_chunk[-3:]  # Keep last 3 words for context
-                current_chunk = overlap_words if overlap_words else []
-                current_length = sum(len(w) + 1 for w in current_chunk)
-            
-            current_chunk.append(word)
-            current_length += word_length
-        
-        # Add remaining chunk if it exists
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            chunked_texts.append({
-                'text': chunk_text,
-                'source': entry['source'],
-                'metadata': entry['metadata'].copy()  # Make a copy to avoid reference issues
-            })
     
     return chunked_texts
     
 
-def batch_embed_chunks_with_labels(text_data, company_id):
+def label_chunk(chunk):
+    """Add source and label information to the chunk text for better semantic understanding"""
+    sources_str = chunk['source']
+    
+    # Special handling for email data with spam/nonspam labels
+    if sources_str == 'email':
+        label = chunk['metadata'].get('label', 'unknown')
+        context = f"Source: {sources_str}, Classification: {label}"
+    else:
+        context = f"Source: {sources_str}"
+    
+    return f"{chunk['text']} ({context})"
+
+def embed_in_batches(texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Encode texts in mini-batches, yielding (positions, embeddings) as each batch completes.
+    Cached embeddings are yielded first; the remaining texts are sorted by length so
+    each batch pads to a similar sequence length.
+    """
+    cached = embedding_cache.get_many(texts) if embedding_cache else [None] * len(texts)
+    
+    hit_positions = [i for i, embedding in enumerate(cached) if embedding is not None]
+    for start in range(0, len(hit_positions), batch_size):
+        positions = hit_positions[start:start + batch_size]
+        yield positions, [cached[i] for i in positions]
+    
+    misses = [i for i, embedding in enumerate(cached) if embedding is None]
+    order = sorted(misses, key=lambda i: len(texts[i]))
+    
+    for start in range(0, len(order), batch_size):
+        positions = order[start:start + batch_size]
+        batch_texts = [texts[i] for i in positions]
+        # Errors propagate: a dropped batch would leave its source recorded without those chunks
+        embeddings = models.get('embedding').encode(
+            batch_texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        
+        if embedding_cache:
+            try:
+                embedding_cache.put_many(batch_texts, embeddings)
+            except Exception as e:
+                print(f"Error writing embedding cache: {e}")
+        yield positions, embeddings
+
+def chunk_vector_id(chunk):
+    """
+    Content-derived ID shared by a chunk's vector and Firestore document, so storing
+    the same chunk again (a retried or resumed run) overwrites instead of duplicating.
+    The page and the chunk's position keep repeated boilerplate within a file apart.
+    """
+    metadata = chunk['metadata']
+    key = json.dumps([
+        chunk['source'], metadata.get('filename', ''), metadata.get('label', ''), metadata.get('row'),
+        metadata.get('page'), chunk.get('position'), chunk['text']
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def create_document_writer():
+    return FirestoreBatchWriter(db, FIRESTORE_BATCH_SIZE, FIRESTORE_WRITERS)
+
+def flush_documents(doc_writer):
+    """Wait until every queued Firestore write is committed"""
+    try:
+        doc_writer.flush()
+    except Exception as e:
+        print(f"Error writing to Firestore: {e}")
+        raise RuntimeError("Failed to store chunk documents") from e
+
+def batch_embed_chunks_with_labels(text_data, company_id, job=None, deduplicator=None, writer=None,
+                                   doc_writer=None):
     """
     Create embeddings for text chunks while preserving source and metadata information.
     Args:
         text_data: List of dictionaries containing text, source, and metadata
         company_id: ID of the company
+        job: Optional ingestion job to report progress to
+        deduplicator: Optional ChunkDeduplicator shared by the waves of an ingestion run
+        writer: Optional VectorUpsertWriter that each embedding batch is streamed to
+        doc_writer: Optional FirestoreBatchWriter for the chunk documents; without one,
+            a writer is created for this call and flushed before returning
     Returns:
         List of dictionaries formatted for Pinecone with id, values, and metadata
     """
     embeddings_list = []
-    id_counter = 1
+    lexical_docs = []
     
-    # First chunk the texts into smaller pieces
+    # First chunk the texts into smaller pieces, dropping duplicates before they cost an embedding
     chunked_texts = chunk_text(text_data)
+    if deduplicator is not None:
+        chunked_texts = deduplicator.filter(chunked_texts)
+    labeled_chunks = [label_chunk(chunk) for chunk in chunked_texts]
+    
+    # Firestore commits run on the writer's own threads instead of stalling the embedder
+    owns_doc_writer = doc_writer is None
+    if owns_doc_writer:
+        doc_writer = create_document_writer()
+    
+    chunk_store = chunk_stores.get(company_id) if chunk_stores else None
     
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {}
-        for chunk in chunked_texts:
-            # Add source and label information to the text
-            sources_str = chunk['source']
+    # Write each embedding batch out as soon as it is encoded
+    for positions, batch_embeddings in embed_in_batches(labeled_chunks):
+        store_records = []
+        batch_start = len(embeddings_list)
+        for position, embeddings in zip(positions, batch_embeddings):
+            chunk = chunked_texts[position]
+            # Create a document reference named after the chunk content
+            doc_ref = db.collection(f'company-{company_id}-texts').document(chunk_vector_id(chunk))
+            chunk['text_id'] = doc_ref.id
+            
+            # Prepare document data - preserve original text without context
+            now = datetime.now()
+            doc_data = {
+                'text': chunk['text'],
+                'source': chunk['source'],
+                'metadata': chunk['metadata'],
+                'timestamp': now.strftime('%Y-%m-%d %H:%M:%S')
+            }
             
-            # Special handling for email data with spam/nonspam labels
-            if sources_str == 'email':
-                label = chunk['metadata'].get('label', 'unknown')
-                context = f"Source: {sources_str}, Classification: {label}"
-            else:
-                context = f"Source: {sources_str}"
+            doc_writer.set(doc_ref, doc_data)
+            store_records.append((doc_ref.id, doc_data))
             
-            # Add context to the chunk for better semantic understanding
-            labeled_chunk = f"{chunk['text']} ({context})"
-            futures[executor.submit(model.encode, labeled_chunk)] = chunk
+            # Store essential metadata with embedding; created_at is numeric so date filters can use ranges
+            metadata = {
+                "sources": chunk['source'],
+                "labels": str(chunk['metadata'].get('label', 'unknown')),
+                "timestamp": doc_data['timestamp'],
+                "created_at": int(now.timestamp()),
+                "filename": str(chunk['metadata'].get('filename', '')),
+                "text_id": doc_ref.id
+            }
+            if 'page' in chunk['metadata']:
+                metadata["page"] = chunk['metadata']['page']
+            lexical_docs.append((doc_ref.id, chunk['text'], metadata))
+            
+            # The vector shares the document's content-derived ID
+            embeddings_list.append({
+                "id": doc_ref.id,
+                "metadata": metadata,
+                "values": embeddings.tolist()
+            })
         
-        batch_size = 100  # Process Firestore operations in batches
-        current_batch = []
+        # Upserts of this batch overlap with embedding the next one
+        if writer is not None:
+            writer.add(embeddings_list[batch_start:])
         
-        for future in as_completed(futures):
-            chunk = futures[future]
+        # Keep a local copy of the chunk text next to the vectors for query time
+        if chunk_store is not None:
             try:
-                embeddings = future.result()
-                
-                # Create a new document reference
-                doc_ref = db.collection(f'company-{company_id}-texts').document()
-                
-                # Prepare document data - preserve original text without context
-                doc_data = {
-                    'text': chunk['text'],
-                    'source': chunk['source'],
-                    'metadata': chunk['metadata'],
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                # Add to current batch
-                current_batch.append((doc_ref, doc_data))
-                
-                # Store essential metadata with embedding
-                metadata = {
-                    "sources": chunk['source'],
-                    "labels": str(chunk['metadata'].get('label', 'unknown')),
-                    "timestamp": doc_data['timestamp'],
-                    "text_id": doc_ref.id
-                }
-                
-                embeddings_list.append({
-                    "id": f"vec{id_counter}",
-                    "metadata": metadata,
-                    "values": embeddings.tolist()
-                })
-                id_counter += 1
-                
-                # If batch is full, commit to Firestore
-                if len(current_batch) >= batch_size:
-                    batch = db.batch()
-                    for ref, data in current_batch:
-                        batch.set(ref, data)
-                    batch.commit()
-                    current_batch = []
-                    
+                chunk_store.append(store_records)
             except Exception as e:
-                print(f"Error processing chunk: {e}")
+                print(f"Error writing chunk store: {e}")
         
-        # Commit any remaining documents in the final batch
-        if current_batch:
-            batch = db.batch()
-            for ref, data in current_batch:
-                batch.set(ref, data)
-            batch.commit()
+        if job:
+            job.advance('chunks_embedded', len(positions))
+    
+    if owns_doc_writer:
+        try:
+            flush_documents(doc_writer)
+        finally:
+            doc_writer.close()
+
+    if embedding_cache:
+        print(f"Embedding cache: {embedding_cache.stats()}")
+
+    # Stage the vectors for the in-process ANN index; the run commits them once at the end
+    if ann_store is not None and embeddings_list:
+        ann_store.stage(f"company-{company_id}", embeddings_list)
+    
+    # Index the chunk text for exact-term matches (invoice IDs, clause numbers, ...)
+    if lexical_store is not None and lexical_docs:
+        try:
+            lexical_store.add(f"company-{company_id}", lexical_docs)
+        except Exception as e:
+            print(f"Error updating lexical index: {e}")
     
     return embeddings_list
 
@@ -526,19 +746,320 @@ def format_document_context(doc_data):
         context += f"Classification: {metadata['label']}\n"
     # Add filename for other sources
     elif 'filename' in metadata:
-        context += f"File: {metadata['filename']}\n"
+        context += f"File: {metadata['filename']}"
+        context += f", page {metadata['page']}\n" if 'page' in metadata else "\n"
     
     return context.strip()
 
+def file_md5(path):
+    """Base64 MD5 of a local file, matching the format Cloud Storage reports for blobs"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+def list_ingestion_sources(files, include_emails=True):
+    """List every ingestible source with the version information used for change detection"""
+    sources = []
+    for file_type in ['pdf', 'image', 'audio']:
+        for blob in files[file_type]:
+            sources.append({
+                'name': blob.name,
+                'generation': str(blob.generation),
+                'md5': blob.md5_hash
+            })
+    
+    if include_emails and os.path.exists(EMAIL_DATA_PATH):
+        sources.append({
+            'name': EMAIL_DATA_PATH,
+            'generation': str(int(os.path.getmtime(EMAIL_DATA_PATH))),
+            'md5': file_md5(EMAIL_DATA_PATH)
+        })
+    
+    return sources
+
+def group_ids_by_source(embeddings_list):
+    """Map each source filename to the IDs it produced; vectors share their document's ID"""
+    ids_by_name = defaultdict(list)
+    for vector in embeddings_list:
+        ids_by_name[vector['metadata'].get('filename', '')].append(vector['id'])
+    return ids_by_name
+
+def commit_ann_index(company_id, complete=False):
+    """
+    Rebuild and persist the company's ANN index once with every vector staged by the run.
+    complete marks a run that started from an empty namespace, so the index holds all of it.
+    """
+    if ann_store is None:
+        return
+    try:
+        ann_store.commit(f"company-{company_id}", complete)
+    except Exception as e:
+        print(f"Error updating ANN index: {e}")
+        # An index missing this run's vectors must not keep serving queries
+        ann_store.drop(f"company-{company_id}")
+
+def invalidate_query_caches(company_id):
+    """Drop cached documents and answers after a company's corpus changes"""
+    document_cache.invalidate(company_id)
+    answer_cache.invalidate(company_id)
+
+def delete_source_embeddings(company_id, manifest, entries):
+    """
+    Delete the vectors and Firestore documents recorded for the given manifest entries,
+    reading their IDs part by part so large sources are never held in memory at once
+    """
+    namespace = f"company-{company_id}"
+    chunk_store = chunk_stores.find(company_id) if chunk_stores else None
+    collection_ref = db.collection(f'company-{company_id}-texts')
+    deleted_vectors = deleted_texts = 0
+    text_ids, vector_ids = [], []
+
+    def flush():
+        if vector_ids:
+            retriever.delete(vector_ids, namespace)
+            if chunk_store is not None:
+                chunk_store.delete(vector_ids)
+            if lexical_store is not None:
+                lexical_store.remove(namespace, vector_ids)
+        for text_id in text_ids:
+            doc_writer.delete(collection_ref.document(text_id))
+        flush_documents(doc_writer)
+        text_ids.clear()
+        vector_ids.clear()
+
+    doc_writer = create_document_writer()
+    try:
+        for entry in entries:
+            for part_text_ids, part_vector_ids in manifest.iter_ids(entry):
+                text_ids.extend(part_text_ids)
+                vector_ids.extend(part_vector_ids)
+                deleted_texts += len(part_text_ids)
+                deleted_vectors += len(part_vector_ids)
+                if len(vector_ids) >= DELETE_BATCH_SIZE:
+                    flush()
+        flush()
+    finally:
+        doc_writer.close()
+    invalidate_query_caches(company_id)
+    
+    print(f"Deleted {deleted_vectors} vectors and {deleted_texts} documents for {len(entries)} sources")
+
+def update_duplicate_pointers(company_id, late_duplicates, doc_writer):
+    """Rewrite the duplicate lists of chunks that gained duplicates in a later wave"""
+    collection_ref = db.collection(f'company-{company_id}-texts')
+    for text_id, duplicates in late_duplicates:
+        doc_writer.update(collection_ref.document(text_id), {'metadata.duplicates': duplicates})
+    flush_documents(doc_writer)
+
+def flush_vectors(writer):
+    """Wait until every vector handed to the writer is stored"""
+    try:
+        writer.flush()
+    except Exception as e:
+        print(f"Error upserting to Pinecone: {e}")
+        raise RuntimeError("Failed to store embeddings") from e
+
+def ingestion_checkpoint(company_id):
+    return IngestionCheckpoint(os.path.join(INGESTION_CHECKPOINT_DIR, f"company-{company_id}.jsonl"))
+
+def ingest_email_source(company_id, source, manifest, writer, doc_writer, job=None, deduplicator=None):
+    """
+    Stream the email records through chunking, embedding and upsert in batches of
+    EMAIL_BATCH_SIZE rows, so memory stays flat however large the file is. Progress is
+    checkpointed after every stored batch and a later run of the same file version
+    resumes after the last one. Returns the number of vectors stored.
+    """
+    checkpoint = ingestion_checkpoint(company_id)
+    version = f"{source['generation']}:{source['md5']}"
+    start_row = checkpoint.resume(source['name'], version)
+    if start_row:
+        print(f"Resuming {source['name']} from row {start_row}")
+    
+    # The entry stays marked as partly stored until every batch is in
+    manifest.begin(source)
+    count = 0
+    for next_row, records in iter_record_batches(
+        source['name'], EMAIL_COLUMN_MAP, EMAIL_BATCH_SIZE, start_row, EMAIL_ENCODING
+    ):
+        vectors = batch_embed_chunks_with_labels(
+            extract_text_from_data({'emails': records}), company_id, job, deduplicator, writer, doc_writer
+        )
+        flush_vectors(writer)
+        flush_documents(doc_writer)
+        # IDs are recorded before the checkpoint moves past them; a redone batch overwrites its part
+        manifest.append_ids(source, start_row, [vector['id'] for vector in vectors])
+        checkpoint.append(source['name'], version, next_row)
+        start_row = next_row
+        count += len(vectors)
+    
+    if job:
+        job.advance('blobs_extracted')
+    manifest.complete(source)
+    checkpoint.clear()
+    return count
+
+def run_data_lake_ingestion(company_id, update, prefix=None, job=None):
+    """
+    Extract, embed and store a company's data lake. Runs as a background job.
+    Returns a summary of the run; raises on failure so the job is marked failed.
+    """
+    collection_ref = db.collection(f'company-{company_id}-texts')
+    manifest = IngestionManifest(db, company_id)
+    try:
+        docs = list(collection_ref.limit(1).stream())
+        if docs and update and not manifest.load() and not ingestion_checkpoint(company_id).exists():
+            # Data embedded before the manifest existed cannot be updated incrementally
+            print("Documents exist without an ingestion manifest, deleting them")
+            db.recursive_delete(collection_ref)
+            retriever.clear(f"company-{company_id}")
+            invalidate_query_caches(company_id)
+            if chunk_stores:
+                chunk_stores.drop(company_id)
+            if lexical_store is not None:
+                lexical_store.drop(f"company-{company_id}")
+            print("Documents deleted")
+    except Exception as e:
+        print(f"Error checking collection: {e}")
+        # Continue with the process if check fails
+
+    try:
+        # Get the existing app or create new one
+        try:
+            existing_app = firebase_admin.get_app(f'app-{company_id}')
+        except ValueError:
+            # App doesn't exist, create it
+            new_cred = credentials.Certificate(f'credentials_{company_id}.json')
+            existing_app = firebase_admin.initialize_app(new_cred, {
+                'storageBucket': f"{json.load(open(f'credentials_{company_id}.json'))['project_id']}.firebasestorage.app"
+            }, name=f'app-{company_id}')
+        
+        # Get the bucket from the new app
+        company_bucket = storage.bucket(app=existing_app)
+
+        # List the bucket once for the whole run; the listing is shared with the profile page
+        files = get_company_files(company_id, company_bucket, prefix, max_age=0)
+
+        # Without a manifest the namespace is empty, so this run's vectors are all of it
+        first_ingestion = not manifest.load()
+
+        # Only sources that are new or changed since the last run need processing
+        sources = list_ingestion_sources(files, include_emails=not prefix)
+        changed, stale = manifest.diff(sources, prefix, local_names={EMAIL_DATA_PATH})
+        changed_names = {source['name'] for source in changed}
+        removed_names = [entry['name'] for entry in stale if entry['name'] not in changed_names]
+        print(f"{len(changed)} new or changed sources, {len(removed_names)} removed")
+
+        if stale:
+            delete_source_embeddings(company_id, manifest, stale)
+            # Forget every deleted version right away. Unchanged chunks get the same IDs again,
+            # so a later run must never delete what a crashed run has already re-stored
+            manifest.remove([entry['name'] for entry in stale])
+
+        if not changed:
+            return {
+                "message": "No changes detected",
+                "count": 0,
+                "removed": len(removed_names)
+            }
+
+        # Embed extracted data in waves while the remaining blobs are still being extracted.
+        # Each wave is stored and recorded in the manifest before the next one, so a crashed
+        # run only redoes the sources that had not been stored yet.
+        sources_by_name = {source['name']: source for source in changed}
+        recorded = set()
+        failed = set()
+        count = 0
+        io_stats = BlobIOStats()
+        # The OCR worker is shared by every run, so this run's images are counted separately
+        ocr_stats = OcrStats()
+        deduplicator = ChunkDeduplicator(CHUNK_DEDUP_THRESHOLD) if CHUNK_DEDUP_THRESHOLD else None
+        writer = VectorUpsertWriter(
+            retriever, f"company-{company_id}", UPSERT_BATCH_SIZE, UPSERT_WORKERS, UPSERT_MAX_RETRIES,
+            on_batch=(lambda size: job.advance('vectors_upserted', size)) if job else None
+        )
+        doc_writer = create_document_writer()
+        
+        def store_wave(text_data):
+            vectors = batch_embed_chunks_with_labels(text_data, company_id, job, deduplicator, writer, doc_writer)
+            flush_vectors(writer)
+            flush_documents(doc_writer)
+            names = {entry['metadata'].get('filename') for entry in text_data} & sources_by_name.keys()
+            manifest.record([sources_by_name[name] for name in names], group_ids_by_source(vectors))
+            recorded.update(names)
+            return len(vectors)
+        
+        try:
+            text_data = []
+            for source, entries in iter_collected_data(files, changed_names, job, io_stats, failed, ocr_stats):
+                text_data.extend(extract_text_from_data({source: entries}))
+                if len(text_data) >= INGEST_WAVE_SIZE:
+                    count += store_wave(text_data)
+                    text_data = []
+            if text_data:
+                count += store_wave(text_data)
+            print(f"Blob I/O: {io_stats.to_dict()}, OCR: {ocr_stats.to_dict()}")
+            
+            if EMAIL_DATA_PATH in sources_by_name:
+                count += ingest_email_source(
+                    company_id, sources_by_name[EMAIL_DATA_PATH], manifest, writer, doc_writer, job, deduplicator
+                )
+                recorded.add(EMAIL_DATA_PATH)
+            
+            if deduplicator is not None:
+                update_duplicate_pointers(company_id, deduplicator.late_duplicates(), doc_writer)
+                print(f"Chunk dedup: {deduplicator.stats()}")
+        finally:
+            writer.close()
+            doc_writer.close()
+            # Waves that were stored before a failure still reach the local index
+            commit_ann_index(company_id, first_ingestion)
+        print(f"Upserts: {writer.stats()}, Firestore writes: {doc_writer.stats()}")
+
+        # Sources that produced no text are recorded too, so they are not retried on every update.
+        # Failed ones are left out of the manifest, so the next update retries them.
+        if failed:
+            print(f"{len(failed)} sources failed and will be retried on the next update")
+        manifest.record([
+            source for source in changed if source['name'] not in recorded and source['name'] not in failed
+        ], {})
+        invalidate_query_caches(company_id)
+
+        if not count:
+            return {"message": "No files found to process", "count": 0, "failed": len(failed), "io": io_stats.to_dict()}
+
+        return {
+            "message": "Data processed and stored successfully", 
+            "count": count,
+            "changed": len(changed),
+            "removed": len(removed_names),
+            "failed": len(failed),
+            "io": io_stats.to_dict(),
+            "ocr": ocr_stats.to_dict(),
+            "dedup": deduplicator.stats() if deduplicator is not None else None
+        }
+
+    finally:
+        # Clean up
+        if f'app-{company_id}' in firebase_admin._apps:
+            firebase_admin.delete_app(firebase_admin.get_app(f'app-{company_id}'))
+
 @app.route('/api/data-lake', methods=['POST'])
 def data_lake_embeddings():
     try:
+        if not models.allowed('ocr'):
+            return jsonify({"error": f"Ingestion is disabled for the '{BACKEND_ROLE}' role"}), 503
+
         company_id = request.form.get('company_id')
         print(f"Company ID: {company_id}")
         if not company_id:
             return jsonify({"error": "Company ID is required"}), 400
+        if not valid_company_id(company_id):
+            return jsonify({"error": "Invalid company ID"}), 400
 
         update = request.form.get('update', False)
+        prefix = request.form.get('prefix') or None
 
         if not update:
             # Handle the credentials file
@@ -549,71 +1070,29 @@ def data_lake_embeddings():
             if credentials_file.filename == '':
                 return jsonify({"error": "No selected file"}), 400
 
-        # Check if documents already exist in collection
-        collection_ref = db.collection(f'company-{company_id}-texts')
-        try:
-            docs = collection_ref.limit(1).stream()
-            # If any document exists, return early
-            if list(docs) and not update:
-                print("Documents already exist in collection")
-                return jsonify({"message": "Already embedded"}), 200
-            elif list(docs) and update:
-                print("Documents already exist in collection")
-                # delete all documents
-                collection_ref.delete()
-                print("Documents deleted")
-        except Exception as e:
-            print(f"Error checking collection: {e}")
-            # Continue with the process if check fails
-
-        
+            # Check if documents already exist in collection
+            try:
+                docs = db.collection(f'company-{company_id}-texts').limit(1).stream()
+                # If any document exists, return early
+                if list(docs):
+                    print("Documents already exist in collection")
+                    return jsonify({"message": "Already embedded"}), 200
+            except Exception as e:
+                print(f"Error checking collection: {e}")
+                # Continue with the process if check fails
 
-        if not update:
             # Save the credentials file permanently
             credentials_file.save(f'credentials_{company_id}.json')
-        
-        try:
-            # Get the existing app or create new one
-            try:
-                existing_app = firebase_admin.get_app(f'app-{company_id}')
-            except ValueError:
-                # App doesn't exist, create it
-                new_cred = credentials.Certificate(f'credentials_{company_id}.json')
-                existing_app = firebase_admin.initialize_app(new_cred, {
-                    'storageBucket': f"{json.load(open(f'credentials_{company_id}.json'))['project_id']}.firebasestorage.app"
-                }, name=f'app-{company_id}')
-            
-            # Get the bucket from the new app
-            company_bucket = storage.bucket(app=existing_app)
-
-            # Fetch data from the data lake API
-            data = collect_data(company_bucket)
-            if data is None:
-                return jsonify({"error": "Failed to collect data"}), 500
-
-            # Process the extracted data
-            if data:
-                text_data = extract_text_from_data(data)
-                embeddings_list = batch_embed_chunks_with_labels(text_data, company_id)
-                if embeddings_list:
-                    try:    
-                        namespace = f"company-{company_id}"
-                        index.upsert(vectors=embeddings_list, namespace=namespace)
-                    except Exception as e:
-                        print(f"Error upserting to Pinecone: {e}")
-                        return jsonify({"error": "Failed to store embeddings"}), 500
-                
-                    return jsonify({
-                        "message": "Data processed and stored successfully", 
-                        "count": len(embeddings_list)
-                    })
-                else:
-                    return jsonify({"message": "No files found to process"}), 200
 
-        finally:
-            # Clean up
-            if f'app-{company_id}' in firebase_admin._apps:
-                firebase_admin.delete_app(firebase_admin.get_app(f'app-{company_id}'))
+        # Run the pipeline in the background and hand back a job ID to poll
+        job, created = ingestion_jobs.submit(company_id, run_data_lake_ingestion, company_id, update, prefix)
+        if not created:
+            return jsonify({
+                "error": "An ingestion job is already running for this company",
+                "job_id": job.id
+            }), 409
+
+        return jsonify({"job_id": job.id, "status": job.status}), 202
             
     except Exception as e:
         print(f"Error in data lake processing: {str(e)}")
@@ -621,100 +1100,297 @@ def data_lake_embeddings():
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/data-lake/jobs/<job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+def is_chart_query(query):
+    return 'graph' in query.lower() or 'chart' in query.lower()
+
+# Query filter fields and the vector metadata fields they match
+FILTER_FIELDS = {'source': 'sources', 'label': 'labels', 'filename': 'filename'}
+
+def parse_filter_date(value, end_of_day=False):
+    """Epoch seconds for an ISO date or datetime; a bare date_to date covers the whole day"""
+    if not isinstance(value, str):
+        raise ValueError("dates must be ISO 8601 strings")
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    return int(parsed.timestamp())
+
+def build_metadata_filter(filters):
+    """
+    Translate request filters into a Pinecone metadata filter, e.g.
+    {"source": "email", "label": ["nonspam"], "date_from": "2024-01-01"}.
+    Returns None when nothing is filtered; raises ValueError on invalid filters.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+
+    unknown = set(filters) - set(FILTER_FIELDS) - {'date_from', 'date_to'}
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    metadata_filter = {}
+    for name, field in FILTER_FIELDS.items():
+        values = filters.get(name)
+        if values is None:
+            continue
+        values = values if isinstance(values, list) else [values]
+        if not values or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{name} must be a string or a list of strings")
+        metadata_filter[field] = {'$in': sorted(set(values))}
+
+    created_at = {}
+    if filters.get('date_from'):
+        created_at['$gte'] = parse_filter_date(filters['date_from'])
+    if filters.get('date_to'):
+        created_at['$lte'] = parse_filter_date(filters['date_to'], end_of_day=True)
+    if created_at:
+        metadata_filter['created_at'] = created_at
+
+    validate_filter(metadata_filter)
+    return metadata_filter or None
+
+def validate_query_request(data):
+    """
+    Validate a query request body.
+    Returns (query, company_id, top_k, metadata_filter, error) where error is a Flask response tuple or None.
+    """
+    if not data or 'query' not in data:
+        return None, None, None, None, (jsonify({"error": "No query provided"}), 400)
+
+    # Get company ID from body
+    company_id = data.get('company_id')
+    if not company_id:
+        return None, None, None, None, (jsonify({"error": "Company ID is required"}), 400)
+    if not valid_company_id(company_id):
+        return None, None, None, None, (jsonify({"error": "Invalid company ID"}), 400)
+
+    try:
+        top_k = int(data.get('top_k', DEFAULT_TOP_K))
+    except (TypeError, ValueError):
+        return None, None, None, None, (jsonify({"error": "top_k must be an integer"}), 400)
+    if top_k < 1 or top_k > MAX_TOP_K:
+        return None, None, None, None, (jsonify({"error": f"top_k must be between 1 and {MAX_TOP_K}"}), 400)
+
+    try:
+        metadata_filter = build_metadata_filter(data.get('filters'))
+    except ValueError as e:
+        return None, None, None, None, (jsonify({"error": f"Invalid filters: {e}"}), 400)
+
+    return data['query'], company_id, top_k, metadata_filter, None
+
+def remember_query(company_id, query):
+    """Add a query to the company's history and return the recent queries"""
+    try:
+        # Store this query in the company's history
+        company_queries[company_id].append(query)
+        # Keep only the most recent 10 queries
+        if len(company_queries[company_id]) > 10:
+            company_queries[company_id].pop(0)
+        return company_queries[company_id]
+    except Exception as e:
+        print(f"Error handling query history: {e}")
+        return None  # Fallback to no history
+
 @app.route('/api/process-query', methods=['POST'])
 def process_query():
     try:
-        data = request.json
-        if not data or 'query' not in data:
-            return jsonify({"error": "No query provided"}), 400
-
-        # Get company ID from body
-        company_id = data.get('company_id')
-        if not company_id:
-            return jsonify({"error": "Company ID is required"}), 400
+        query, company_id, top_k, metadata_filter, error = validate_query_request(request.json)
+        if error:
+            return error
 
-        query = data['query']
-        
-        try:
-            # Store this query in the company's history
-            company_queries[company_id].append(query)
-            # Keep only the most recent 10 queries
-            if len(company_queries[company_id]) > 10:
-                company_queries[company_id].pop(0)
-            recent_queries = company_queries[company_id]
-        except Exception as e:
-            print(f"Error handling query history: {e}")
-            recent_queries = None  # Fallback to no history
+        recent_queries = remember_query(company_id, query)
         
         # Generate embedding for the query
-        query_embedding = model.encode(query)
+        query_embedding = models.get('embedding').encode(query)
+        
+        # Answer near-identical questions from the cache; chart and text answers never mix
+        cache_key = (is_chart_query(query), top_k, json.dumps(metadata_filter, sort_keys=True))
+        corpus_version = answer_cache.version(company_id)
+        cached_response = answer_cache.lookup(company_id, query_embedding, cache_key)
+        if cached_response is not None:
+            return jsonify(cached_response)
         
         # Send to calculate_similarity internally with query history
-        similarity_response = calculate_similarity(query, query_embedding.tolist(), company_id, recent_queries)
+        started = time.time()
+        similarity_response, fallback = calculate_similarity(
+            query, query_embedding.tolist(), company_id, recent_queries, top_k, metadata_filter
+        )
+        # A placeholder chart would otherwise answer every similar query until the entry expires
+        if not fallback:
+            answer_cache.store(
+                company_id, query_embedding, similarity_response, time.time() - started,
+                key=cache_key, version=corpus_version
+            )
         
         return jsonify(similarity_response)
     except Exception as e:
         print(f"Process query error: {e}")
         return jsonify({"error": str(e)}), 500
 
-def calculate_similarity(query, query_embedding, company_id, recent_queries=None):
-    query_embedding = np.array(query_embedding)
-    namespace = f"company-{company_id}"
-    vector_ids = index.list(namespace=namespace)
-
-    text_embeddings = []
-    sentences = []
-    metadatas = []
+def sse_event(event, data):
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    for vector_id in vector_ids:
-        fetched_vector = index.fetch(ids=vector_id, namespace=namespace)
-        vectors = fetched_vector.get('vectors', {})
-        
-        for vec_id, vector_data in vectors.items():
-            sentences.append(vec_id)
-            text_embeddings.append(vector_data['values'])
-            metadata = vector_data['metadata']
-            # Include text text in context
-            context = {
-                'text_id': metadata.get('text_id', ''),
-                'source': metadata.get('sources', 'unknown'),
-                'label': metadata.get('labels', 'unknown')
-            }
-            metadatas.append(context)
+@app.route('/api/process-query/stream', methods=['POST'])
+def process_query_stream():
+    """
+    Streaming variant of /api/process-query using server-sent events:
+    a 'retrieval' event with the ranked matches, 'token' events with answer text as
+    Gemini produces it, then a 'done' event with the full response (parsed chart JSON
+    for chart queries). Failures are reported as an 'error' event.
+    """
+    query, company_id, top_k, metadata_filter, error = validate_query_request(request.json)
+    if error:
+        return error
 
-    text_embeddings = np.array(text_embeddings)
+    recent_queries = remember_query(company_id, query)
 
-    if query_embedding.ndim == 1:
-        query_embedding = query_embedding.reshape(1, -1)
+    def generate():
+        try:
+            query_embedding = models.get('embedding').encode(query)
+
+            cache_key = (is_chart_query(query), top_k, json.dumps(metadata_filter, sort_keys=True))
+            corpus_version = answer_cache.version(company_id)
+            cached_response = answer_cache.lookup(company_id, query_embedding, cache_key)
+            if cached_response is not None:
+                yield sse_event('done', cached_response)
+                return
+
+            started = time.time()
+            results, contexts = retrieve_contexts(query, query_embedding.tolist(), company_id, top_k, metadata_filter)
+            yield sse_event('retrieval', {"results": results})
+
+            prompt = build_gemini_prompt(query, contexts, recent_queries)
+            print(f"Prompt tokens: {context_packer.record_prompt(prompt)}")
+            parts = []
+            for chunk in gemini_model.generate_content(prompt, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text (e.g. safety metadata) carry nothing to forward
+                    continue
+                if not text:
+                    continue
+                parts.append(text)
+                # Chart JSON is only useful once complete, so it is not streamed token by token
+                if not is_chart_query(query):
+                    yield sse_event('token', {"text": text})
+
+            response, fallback = parse_gemini_text(query, ''.join(parts))
+            if not fallback:
+                answer_cache.store(
+                    company_id, query_embedding, response, time.time() - started,
+                    key=cache_key, version=corpus_version
+                )
+            yield sse_event('done', response)
+        except Exception as e:
+            print(f"Process query stream error: {e}")
+            yield sse_event('error', {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def fetch_documents(company_id, text_ids):
+    """Fetch chunk documents by text ID with one batched read, serving repeats from the LRU cache"""
+    docs = document_cache.get_many(company_id, text_ids)
+    missing = [text_id for text_id in dict.fromkeys(text_ids) if text_id not in docs]
+    
+    if missing:
+        collection_ref = db.collection(f"company-{company_id}-texts")
+        fetched = {}
+        for snapshot in db.get_all([collection_ref.document(text_id) for text_id in missing]):
+            if snapshot.exists:
+                fetched[snapshot.id] = snapshot.to_dict()
+        document_cache.put_many(company_id, fetched)
+        docs.update(fetched)
+    
+    return docs
 
-    similarities = cosine_similarity(query_embedding, text_embeddings)[0]
-    top_indices = np.argsort(similarities)[-15:][::-1]
+def hydrate_results(company_id, results):
+    """
+    Return the chunk documents for ranked results, in rank order. The local chunk store
+    answers by vector ID; only chunks missing from it are read from Firestore.
+    """
+    chunk_store = chunk_stores.find(company_id) if chunk_stores else None
+    docs = chunk_store.get_many([result['id'] for result in results]) if chunk_store is not None else {}
+    
+    missing = [result['text_id'] for result in results if result['id'] not in docs and result['text_id']]
+    text_docs = fetch_documents(company_id, missing) if missing else {}
+    
+    hydrated = []
+    for result in results:
+        doc = docs.get(result['id']) or text_docs.get(result['text_id'])
+        if doc:
+            hydrated.append(doc)
+    return hydrated
 
-    results = [
-        {
-            'index': int(idx),
-            'id': sentences[idx],
-            'similarity': float(similarities[idx]),
-            'text_id': metadatas[idx]["text_id"]
+def fuse_results(matches, lexical_hits, top_k):
+    """
+    Merge vector matches and BM25 hits with reciprocal rank fusion.
+    Each result keeps the scores of the rankers that found it.
+    """
+    entries = {}
+    for match in matches:
+        entries[match['id']] = {
+            'id': match['id'],
+            'similarity': match['score'],
+            'bm25': None,
+            'text_id': match['metadata'].get('text_id', '')
         }
-        for idx in top_indices
-    ]
+    for vec_id, score, metadata in lexical_hits:
+        entry = entries.setdefault(vec_id, {'id': vec_id, 'similarity': None, 'text_id': metadata.get('text_id', '')})
+        entry['bm25'] = score
     
-    # For Gemini, we'll provide structured contexts
-    text_ids = [result["text_id"] for result in results]
+    fused = reciprocal_rank_fusion(
+        [[match['id'] for match in matches], [hit[0] for hit in lexical_hits]], RRF_K
+    )
+    return [
+        {'index': rank, **entries[vec_id], 'score': score}
+        for rank, (vec_id, score) in enumerate(fused[:top_k])
+    ]
 
-    contexts = []   
-    for text_id in text_ids:
-        doc = db.collection(f"company-{company_id}-texts").document(text_id).get().to_dict()
-        if doc:
-            contexts.append(format_document_context(doc))
+def retrieve_contexts(query, query_embedding, company_id, top_k=DEFAULT_TOP_K, metadata_filter=None):
+    """
+    Rank the company's chunks for a query and return (results, formatted contexts).
+    The metadata filter is applied inside each index, before anything is scored.
+    """
+    namespace = f"company-{company_id}"
+
+    # Vector and BM25 rankings are fused, so each ranker contributes a wider candidate list
+    candidates = top_k * HYBRID_CANDIDATES if lexical_store is not None else top_k
+    matches = retriever.query(query_embedding, namespace, candidates, filter=metadata_filter)
+    lexical_hits = []
+    if lexical_store is not None:
+        lexical_hits = lexical_store.search(namespace, query, candidates, filter=metadata_filter)
+
+    results = fuse_results(matches, lexical_hits, top_k)
     
-    # Call Gemini with structured contexts and query history
-    gemini_response = process_gemini(query, contexts, recent_queries)
+    # For Gemini, we'll provide structured contexts packed into the prompt token budget
+    contexts, pack_stats = context_packer.pack(hydrate_results(company_id, results), format_document_context)
+    print(f"Context packing: {pack_stats}")
     
-    return gemini_response
+    return results, contexts
 
-def process_gemini(query, contexts, recent_queries=None):
+def calculate_similarity(query, query_embedding, company_id, recent_queries=None, top_k=DEFAULT_TOP_K,
+                         metadata_filter=None):
+    _, contexts = retrieve_contexts(query, query_embedding, company_id, top_k, metadata_filter)
+    
+    # Call Gemini with structured contexts and query history; returns (response, fallback)
+    return process_gemini(query, contexts, recent_queries)
+
+def build_gemini_prompt(query, contexts, recent_queries=None):
     # Create a context header that summarizes previous interactions
     conversation_context = ""
     if recent_queries and len(recent_queries) > 1:  # Only add context if there are previous queries
@@ -723,7 +1399,7 @@ def process_gemini(query, contexts, recent_queries=None):
             conversation_context += f"- {prev_query}\n"
         conversation_context += "\n"
     
-    if 'graph' in query.lower() or 'chart' in query.lower():
+    if is_chart_query(query):
         # Modified prompt for graph data
         prompt = f"""{conversation_context}Given the following structured contexts and query, provide data that can be visualized as a chart. Each context contains Content, Source, Time, and optional Classification or File information.
 
@@ -765,21 +1441,25 @@ Query: {query}
 
 Answer:"""
 
-    response = gemini_model.generate_content(prompt)
-    text = response.candidates[0].content.parts[0].text
+    return prompt
 
-    if 'graph' in query.lower() or 'chart' in query.lower():
+def parse_gemini_text(query, text):
+    """
+    Turn Gemini's answer text into the API response, parsing chart JSON for chart queries.
+    Returns (response, fallback); fallback is set when a placeholder chart stands in for
+    chart JSON that did not parse, so the response must not be cached.
+    """
+    if is_chart_query(query):
         try:
             # Clean the text response by removing markdown formatting
             clean_text = text.replace('```json\n', '').replace('```', '').strip()
             # Parse the JSON response from Gemini
-            import json
             chart_data = json.loads(clean_text)
             print(f"Chart data: {chart_data}")
             return {
                 "type": "graph",
                 "graphData": chart_data
-            }
+            }, False
         except json.JSONDecodeError as e:
             print(f"Error parsing JSON: {e}")
             # Fallback to generate basic chart data
@@ -797,10 +1477,17 @@ Answer:"""
             return {
                 "type": "graph",
                 "graphData": basic_chart_data
-            }
+            }, True
     else:
         print(f"Ans resp: {text}")
-        return {"answer": text}
+        return {"answer": text}, False
+
+def process_gemini(query, contexts, recent_queries=None):
+    prompt = build_gemini_prompt(query, contexts, recent_queries)
+    print(f"Prompt tokens: {context_packer.record_prompt(prompt)}")
+    response = gemini_model.generate_content(prompt)
+    text = response.candidates[0].content.parts[0].text
+    return parse_gemini_text(query, text)
 
 @app.route('/api/profile/files', methods=['POST'])
 def get_storage_files():
@@ -811,15 +1498,10 @@ def get_storage_files():
         
         if not company_id:
             return jsonify({"error": "Company ID is required"}), 400
+        if not valid_company_id(company_id):
+            return jsonify({"error": "Invalid company ID"}), 400
 
-        # Initialize empty result structure
-        result = {
-            'pdf': [],
-            'image': [],
-            'audio': [],
-            'video': [],
-            'other': []
-        }
+        prefix = data.get('prefix') or None
 
         app_name = f'app-{company_id}'
         
@@ -837,28 +1519,20 @@ def get_storage_files():
             # Get the bucket from the app
             company_bucket = storage.bucket(app=app)
             
-            blobs = company_bucket.list_blobs()
-            # Process each file in storage
-            for blob in blobs:
-                file_info = {
-                    'name': blob.name,
-                    'size': blob.size,
-                    'updated': blob.updated.strftime('%Y-%m-%d %H:%M:%S') if blob.updated else '',
-                    'contentType': blob.content_type
-                }
-
-                # Categorize based on filename
-                filename = blob.name.lower()
-                if filename.endswith(('.pdf')):
-                    result['pdf'].append(file_info)
-                elif filename.endswith(('.jpg', '.jpeg', '.png')):
-                    result['image'].append(file_info)
-                elif filename.endswith(('.mp3', '.wav')):
-                    result['audio'].append(file_info)
-                elif filename.endswith(('.mp4')):
-                    result['video'].append(file_info)
-                else:
-                    result['other'].append(file_info)
+            # Reuse a recent listing instead of paging through the bucket again
+            files = get_company_files(company_id, company_bucket, prefix)
+            result = {
+                category: [
+                    {
+                        'name': blob.name,
+                        'size': blob.size,
+                        'updated': blob.updated.strftime('%Y-%m-%d %H:%M:%S') if blob.updated else '',
+                        'contentType': blob.content_type
+                    }
+                    for blob in blobs
+                ]
+                for category, blobs in files.items()
+            }
 
             # Calculate statistics
             stats = {
@@ -886,5 +1560,29 @@ def get_storage_files():
         print(f"Error fetching storage files: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify({
+        "role": BACKEND_ROLE,
+        "startup_seconds": round(startup_seconds, 2),
+        "resident_memory_mb": round(resident_memory_mb()),
+        "models": models.status()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "answer_cache": answer_cache.stats(),
+        "prompt": context_packer.stats(),
+        "document_cache": document_cache.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None
+    })
+
+if MODEL_PRELOAD:
+    models.preload()
+
+startup_seconds = time.time() - startup_started
+print(f"Backend started as '{BACKEND_ROLE}' in {startup_seconds:.1f}s, resident memory {resident_memory_mb():.0f} MB")
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
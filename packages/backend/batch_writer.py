@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as google_exceptions
+
+# Firestore errors worth retrying: contention, throttling and transient unavailability
+FIRESTORE_RETRYABLE = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable
+)
+
+
+class BatchWriter:
+    """
+    Pipelined writer stage: add() buffers items and hands every full batch to a worker
+    pool. Once max_in_flight batches are queued or running it blocks, which applies
+    backpressure to the producer. Failed batches are retried with exponential backoff
+    and jitter. flush() waits for everything sent so far and raises the first error.
+    Subclasses implement _write(batch).
+    """
+
+    name = 'batch'
+    retryable = (Exception,)
+
+    def __init__(self, batch_size=100, max_workers=4, max_retries=5, backoff=0.5, max_in_flight=None,
+                 on_batch=None):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_batch = on_batch
+        self.items = 0
+        self.batches = 0
+        self.retries = 0
+        self._buffer = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.name)
+        self._slots = threading.Semaphore(max_in_flight or max_workers * 2)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def _send(self, batch):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._write(batch)
+                    break
+                except self.retryable as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                    print(f"{self.name} write of {len(batch)} items failed ({e}), retrying in {delay:.1f}s")
+                    with self._lock:
+                        self.retries += 1
+                    time.sleep(delay)
+            with self._lock:
+                self.items += len(batch)
+                self.batches += 1
+            if self.on_batch:
+                self.on_batch(len(batch))
+        finally:
+            self._slots.release()
+
+    def _submit(self, batch):
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._send, batch))
+
+    def add(self, items):
+        self._buffer.extend(items)
+        while len(self._buffer) >= self.batch_size:
+            self._submit(self._buffer[:self.batch_size])
+            self._buffer = self._buffer[self.batch_size:]
+
+    def flush(self):
+        """Send any partial batch and wait until every batch is stored"""
+        if self._buffer:
+            self._submit(self._buffer)
+            self._buffer = []
+        futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """Stop the workers; call flush() first to make sure everything was stored"""
+        self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {'items': self.items, 'batches': self.batches, 'retries': self.retries}
+
+
+class VectorUpsertWriter(BatchWriter):
+    """Streams Pinecone-formatted vectors into a retriever namespace"""
+
+    name = 'upsert'
+
+    def __init__(self, retriever, namespace, batch_size=100, max_workers=4, max_retries=5, backoff=0.5,
+                 on_batch=None):
+        super().__init__(batch_size, max_workers, max_retries, backoff, on_batch=on_batch)
+        self.retriever = retriever
+        self.namespace = namespace
+
+    def _write(self, batch):
+        self.retriever.upsert(batch, self.namespace)
+
+
+class FirestoreBatchWriter(BatchWriter):
+    """
+    Commits Firestore writes in batches of up to 500 operations (the batch limit),
+    several commits at a time. Operations are ('set' | 'update' | 'delete', ref, data).
+    """
+
+    name = 'firestore'
+    retryable = FIRESTORE_RETRYABLE
+
+    def __init__(self, db, batch_size=500, max_workers=4, max_retries=5, backoff=0.5, on_batch=None):
+        super().__init__(min(batch_size, 500), max_workers, max_retries, backoff, on_batch=on_batch)
+        self.db = db
+
+    def _write(self, batch):
+        write_batch = self.db.batch()
+        for operation, ref, data in batch:
+            if operation == 'set':
+                write_batch.set(ref, data)
+            elif operation == 'update':
+                write_batch.update(ref, data)
+            else:
+                write_batch.delete(ref)
+        write_batch.commit()
+
+    def set(self, ref, data):
+        self.add([('set', ref, data)])
+
+    def update(self, ref, data):
+        self.add([('update', ref, data)])
+
+    def delete(self, ref):
+        self.add([('delete', ref, None)])
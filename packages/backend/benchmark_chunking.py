@@ -0,0 +1,77 @@
+import argparse
+import time
+
+from chunker import TokenChunker, tokenizer_offsets, whitespace_offsets
+from pdf_extract import extract_pdf_text
+
+
+def legacy_chunks(text, max_chunk_size=512):
+    """The previous character-budget chunker, kept here for comparison"""
+    words = text.split()
+    chunks, current_chunk, current_length = [], [], 0
+    for word in words:
+        word_length = len(word) + 1
+        if current_length + word_length > max_chunk_size and current_chunk:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = current_chunk[-3:]
+            current_length = sum(len(w) + 1 for w in current_chunk)
+        current_chunk.append(word)
+        current_length += word_length
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    return chunks
+
+
+WORDS = ('the supplier shall deliver all goods described in schedule a to the buyer within thirty days '
+         'of the effective date unless otherwise agreed in writing by both parties').split()
+
+
+def make_text(sentences):
+    """Synthetic prose with sentences of 5 to 34 words, used when no PDFs are given"""
+    words = WORDS * 3
+    return ' '.join(
+        ' '.join(words[(i * 7) % len(WORDS):(i * 7) % len(WORDS) + 5 + i % 30]).capitalize() + '.'
+        for i in range(sentences)
+    )
+
+
+def run(texts, tokenizer, max_tokens, overlap, window):
+    offsets = tokenizer_offsets(tokenizer) if tokenizer is not None else whitespace_offsets
+    count_tokens = lambda chunks: [len(starts) for starts, _ in offsets(chunks)]
+
+    started = time.perf_counter()
+    legacy = [chunk for text in texts for chunk in legacy_chunks(text)]
+    legacy_elapsed = time.perf_counter() - started
+
+    chunker = TokenChunker(offsets, max_tokens, overlap)
+    started = time.perf_counter()
+    token_chunks = [chunk for chunks in chunker.split(texts) for chunk in chunks]
+    token_elapsed = time.perf_counter() - started
+
+    characters = sum(len(text) for text in texts)
+    print(f"{len(texts)} documents, {characters / 1e6:.1f}M characters, window {window} tokens")
+    print(f"{'chunker':<10}{'chunks':>10}{'MB/s':>10}{'mean tok':>10}{'max tok':>10}{'over window':>13}")
+    for name, chunks, elapsed in (('legacy', legacy, legacy_elapsed), ('token', token_chunks, token_elapsed)):
+        tokens = count_tokens(chunks)
+        over = sum(count > window for count in tokens)
+        print(f"{name:<10}{len(chunks):>10}{characters / 1e6 / elapsed:>10.2f}{sum(tokens) / len(tokens):>10.1f}"
+              f"{max(tokens):>10}{over / len(chunks):>13.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and window fit of the token chunker on large documents")
+    parser.add_argument('pdfs', nargs='*', help="PDF files to chunk; synthetic text is used when omitted")
+    parser.add_argument('--sentences', type=int, default=50000, help="Sentences of synthetic text")
+    parser.add_argument('--model', default='sentence-transformers/all-MiniLM-L6-v2')
+    parser.add_argument('--whitespace', action='store_true', help="Count whitespace tokens instead of loading the tokenizer")
+    parser.add_argument('--max-tokens', type=int, default=238)
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--window', type=int, default=256)
+    args = parser.parse_args()
+
+    tokenizer = None
+    if not args.whitespace:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+    texts = [extract_pdf_text(path) for path in args.pdfs] or [make_text(args.sentences)]
+    run(texts, tokenizer, args.max_tokens, args.overlap, args.window)
@@ -0,0 +1,41 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ocr_worker import BatchedOcrWorker
+
+
+def run(paths, batch_size, max_side, decode_workers):
+    import easyocr
+    reader = easyocr.Reader(['en'], gpu=False)
+    sources = [open(path, 'rb').read() for path in paths]
+    print(f"{len(sources)} images, CPU only, batch size {batch_size}, max side {max_side or 'full'}")
+
+    started = time.perf_counter()
+    for source in sources:
+        reader.readtext(source)
+    per_image_elapsed = time.perf_counter() - started
+
+    worker = BatchedOcrWorker(lambda: reader, batch_size=batch_size, max_side=max_side)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+        futures = [worker.submit(job) for job in pool.map(worker.prepare, sources)]
+    for future in futures:
+        future.result()
+    batched_elapsed = time.perf_counter() - started
+
+    print(f"{'reader':<16}{'images/s':>10}")
+    print(f"{'readtext':<16}{len(sources) / per_image_elapsed:>10.2f}")
+    print(f"{'batched worker':<16}{len(sources) / batched_elapsed:>10.2f}")
+    print(worker.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Images per second of per-image and batched EasyOCR")
+    parser.add_argument('images', nargs='+', help="Image files to read")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-side', type=int, default=1600)
+    parser.add_argument('--decode-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    run(args.images, args.batch_size, args.max_side, args.decode_workers)
@@ -0,0 +1,60 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_extract import clean_text, count_pdf_pages, extract_pdf_pages, open_pdf, submit_pdf_pages
+
+
+def legacy_clean_text(text):
+    """The previous per-character cleaner, kept here for comparison"""
+    text = ' '.join(text.split())
+    text = text.replace(' ,', ',').replace(' .', '.').replace(' :', ':').replace('●', '\n•')
+    text = ''.join(char for char in text if char.isprintable() or char in ['\n'])
+    return text.strip()
+
+
+def run(paths, workers, pages_per_task):
+    sources = [open(path, 'rb').read() for path in paths]
+    page_count = sum(count_pdf_pages(source) for source in sources)
+    print(f"{len(sources)} PDFs, {page_count} pages, {workers} workers, {pages_per_task} pages per task")
+
+    started = time.perf_counter()
+    serial = [extract_pdf_pages(source) for source in sources]
+    serial_elapsed = time.perf_counter() - started
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the workers so process start-up is not counted
+        list(pool.map(abs, range(workers)))
+        started = time.perf_counter()
+        # Tasks read the PDFs by path, as ingestion does for PDFs spanning several tasks
+        futures = [
+            submit_pdf_pages(pool, path, count_pdf_pages(source), pages_per_task)
+            for path, source in zip(paths, sources)
+        ]
+        parallel = [future.result() for future in futures]
+        parallel_elapsed = time.perf_counter() - started
+
+    assert parallel == serial, "page-parallel extraction differs from serial extraction"
+    print(f"{'extraction':<14}{'pages/s':>10}")
+    print(f"{'serial':<14}{page_count / serial_elapsed:>10.1f}")
+    print(f"{'process pool':<14}{page_count / parallel_elapsed:>10.1f}")
+
+    # Cleaning cost on its own, over the raw text of every page
+    raw = [page.extract_text() or '' for source in sources for page in open_pdf(source).pages]
+    characters = sum(len(text) for text in raw)
+    print(f"{'cleaner':<14}{'MB/s':>10}")
+    for name, cleaner in (('legacy', legacy_clean_text), ('regex', clean_text)):
+        started = time.perf_counter()
+        for text in raw:
+            cleaner(text)
+        print(f"{name:<14}{characters / 1e6 / (time.perf_counter() - started):>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pages per second of serial and page-parallel PDF extraction")
+    parser.add_argument('pdfs', nargs='+', help="PDF files to extract")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--pages-per-task', type=int, default=16)
+    args = parser.parse_args()
+    run(args.pdfs, args.workers, args.pages_per_task)
@@ -0,0 +1,59 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ann_index import AnnIndexStore, _normalize
+
+
+def make_embeddings(count, dim, clusters, seed=0):
+    """Clustered unit vectors, closer to sentence embeddings than isotropic noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.6 * rng.normal(size=(count, dim))
+    return _normalize(vectors)
+
+
+def vector_bytes(index):
+    """Bytes held in memory for scoring: the codes when quantized, otherwise the float32 matrix"""
+    if index.codes is None:
+        return index.vectors.nbytes
+    return index.codes.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+
+
+def run(count, dim, queries, top_k, brute_force_threshold):
+    vectors = make_embeddings(count, dim, clusters=max(count // 500, 8))
+    query_vectors = make_embeddings(queries, dim, clusters=max(count // 500, 8), seed=1)
+    exact = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :top_k]
+    ids = [str(i) for i in range(count)]
+    payload = [{'id': vec_id, 'values': vector} for vec_id, vector in zip(ids, vectors)]
+
+    print(f"{count} vectors x {dim} dims, {queries} queries, recall@{top_k} against exact search")
+    print(f"{'quantization':<14}{'bytes/vector':>14}{'recall':>10}{'ms/query':>10}")
+    for kind in ('none', 'float16', 'int8'):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            store = AnnIndexStore(snapshot_dir, brute_force_threshold=brute_force_threshold, quantization=kind)
+            store.add('benchmark', payload)
+            index = store.get('benchmark')
+
+            hits = 0
+            started = time.perf_counter()
+            for query, expected in zip(query_vectors, exact):
+                found = {int(vec_id) for vec_id, _, _ in index.search(query, top_k)}
+                hits += len(found & set(expected.tolist()))
+            elapsed = time.perf_counter() - started
+
+            print(f"{kind:<14}{vector_bytes(index) / count:>14.1f}{hits / exact.size:>10.3f}"
+                  f"{elapsed / queries * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and memory of quantized ANN vector storage")
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=15)
+    parser.add_argument('--exact', action='store_true', help="Scan every vector instead of probing IVF lists")
+    args = parser.parse_args()
+    run(args.count, args.dim, args.queries, args.top_k, args.count + 1 if args.exact else 1000)
@@ -0,0 +1,146 @@
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+
+# Company IDs become directory names, so only plain identifiers are accepted
+COMPANY_ID = re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+
+def valid_company_id(company_id):
+    return isinstance(company_id, str) and COMPANY_ID.fullmatch(company_id) is not None
+
+
+class ChunkStore:
+    """
+    Append-only store of chunk documents for one company, served by vector ID.
+    Documents are appended as JSON records to chunks.dat and located through an
+    in-memory offset index rebuilt from index.log, whose lines are
+    "<vector id>\\t<offset>\\t<length>" (a negative offset marks a deletion).
+    Reads go through a memory map of the data file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'chunks.dat')
+        self.index_path = os.path.join(directory, 'index.log')
+        self._offsets = {}
+        self._map = None
+        self._mapped_size = 0
+        self._lock = threading.Lock()
+
+        open(self.data_path, 'ab').close()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    vector_id, offset, length = line.rstrip('\n').split('\t')
+                    if int(offset) < 0:
+                        self._offsets.pop(vector_id, None)
+                    else:
+                        self._offsets[vector_id] = (int(offset), int(length))
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def append(self, records):
+        """Append (vector_id, document) pairs"""
+        if not records:
+            return
+        with self._lock:
+            index_lines = []
+            with open(self.data_path, 'ab') as data_file:
+                offset = data_file.tell()
+                for vector_id, doc in records:
+                    payload = json.dumps(doc).encode('utf-8')
+                    data_file.write(payload)
+                    self._offsets[vector_id] = (offset, len(payload))
+                    index_lines.append(f"{vector_id}\t{offset}\t{len(payload)}\n")
+                    offset += len(payload)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            # The index is written after the data so it never points past the end of the file
+            with open(self.index_path, 'a') as index_file:
+                index_file.writelines(index_lines)
+
+    def delete(self, vector_ids):
+        with self._lock:
+            removed = [vector_id for vector_id in vector_ids if self._offsets.pop(vector_id, None)]
+            if removed:
+                with open(self.index_path, 'a') as index_file:
+                    index_file.writelines(f"{vector_id}\t-1\t0\n" for vector_id in removed)
+
+    def _ensure_mapped(self, end):
+        if self._map is not None and end <= self._mapped_size:
+            return
+        if self._map is not None:
+            self._map.close()
+        with open(self.data_path, 'rb') as data_file:
+            self._map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = len(self._map)
+
+    def get_many(self, vector_ids):
+        """Return {vector_id: document} for the IDs present in the store"""
+        found = {}
+        with self._lock:
+            locations = {
+                vector_id: self._offsets[vector_id]
+                for vector_id in vector_ids if vector_id in self._offsets
+            }
+            if not locations:
+                return found
+            self._ensure_mapped(max(offset + length for offset, length in locations.values()))
+            for vector_id, (offset, length) in locations.items():
+                found[vector_id] = json.loads(self._map[offset:offset + length])
+        return found
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._mapped_size = 0
+
+
+class ChunkStoreRegistry:
+    """Opens one ChunkStore per company under root_dir on first use"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, company_id):
+        if not valid_company_id(company_id):
+            raise ValueError(f"Invalid company ID: {company_id!r}")
+        return os.path.join(self.root_dir, f"company-{company_id}")
+
+    def get(self, company_id):
+        """Return the company's store, creating it on disk if needed (ingestion)"""
+        directory = self._directory(company_id)
+        with self._lock:
+            store = self._stores.get(company_id)
+            if store is None:
+                store = ChunkStore(directory)
+                self._stores[company_id] = store
+            return store
+
+    def find(self, company_id):
+        """Return the company's store if one exists on disk, without creating anything (queries)"""
+        directory = self._directory(company_id)
+        with self._lock:
+            store = self._stores.get(company_id)
+            if store is None and os.path.exists(os.path.join(directory, 'chunks.dat')):
+                store = ChunkStore(directory)
+                self._stores[company_id] = store
+            return store
+
+    def drop(self, company_id):
+        directory = self._directory(company_id)
+        with self._lock:
+            store = self._stores.pop(company_id, None)
+        if store is not None:
+            store.close()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,105 @@
+import re
+
+import numpy as np
+
+# A sentence ends at ., ! or ? followed by whitespace, or at a blank line
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+WORD = re.compile(r'\S+')
+
+
+def whitespace_offsets(texts):
+    """Approximate tokenization by whitespace, used when no model tokenizer is available"""
+    offsets = []
+    for text in texts:
+        spans = [match.span() for match in WORD.finditer(text)]
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        offsets.append((spans[:, 0], spans[:, 1]))
+    return offsets
+
+
+def tokenizer_offsets(tokenizer):
+    """
+    Wrap a Hugging Face fast tokenizer as an offsets function: one batched call
+    returning the character span of every token of every text.
+    """
+    def offsets(texts):
+        encoded = tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False
+        )
+        result = []
+        for mapping in encoded['offset_mapping']:
+            spans = np.asarray(mapping, dtype=np.int64).reshape(-1, 2)
+            result.append((spans[:, 0], spans[:, 1]))
+        return result
+    return offsets
+
+
+class TokenChunker:
+    """
+    Splits texts into chunks of at most max_tokens tokens of the embedding model,
+    ending chunks on sentence boundaries and starting the next chunk on the sentence
+    boundary that gives roughly overlap tokens of shared context. Sentences longer
+    than a chunk are cut at token boundaries with an exact overlap.
+
+    Every text in a call is tokenized in a single batched pass; boundaries are then
+    found by binary search over the token start offsets, so chunking is linear in the
+    number of tokens.
+    """
+
+    def __init__(self, offsets=None, max_tokens=240, overlap=32):
+        if overlap >= max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.offsets = offsets or whitespace_offsets
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def _windows(self, text, starts, ends, max_tokens):
+        """Yield (first token, end token) windows over one text"""
+        count = len(starts)
+        if count <= max_tokens:
+            yield 0, count
+            return
+
+        # Token index at which each sentence after the first begins
+        boundaries = np.unique(np.searchsorted(starts, [match.end() for match in SENTENCE_END.finditer(text)]))
+        boundaries = boundaries[(boundaries > 0) & (boundaries < count)]
+        overlap = min(self.overlap, max_tokens - 1)
+
+        start = 0
+        end = 0
+        while start < count:
+            limit = start + max_tokens
+            if limit >= count:
+                yield start, count
+                return
+            # Last sentence boundary that keeps the chunk within the budget; it must lie
+            # past the previous chunk's end, or the chunk would only repeat its tail
+            position = np.searchsorted(boundaries, limit, side='right') - 1
+            end = int(boundaries[position]) if position >= 0 and boundaries[position] > max(start, end) else limit
+            yield start, end
+
+            # Restart at the first sentence boundary inside the overlap window, or exactly overlap tokens back
+            position = np.searchsorted(boundaries, end - overlap)
+            if position < len(boundaries) and start < boundaries[position] < end:
+                start = int(boundaries[position])
+            else:
+                start = max(end - overlap, start + 1)
+
+    def split(self, texts, max_tokens=None):
+        """Return a list of chunk strings for each text"""
+        max_tokens = max_tokens or self.max_tokens
+        chunks = []
+        for text, (starts, ends) in zip(texts, self.offsets(texts)):
+            if not len(starts):
+                chunks.append([])
+                continue
+            chunks.append([
+                text[starts[first]:ends[last - 1]]
+                for first, last in self._windows(text, starts, ends, max_tokens)
+            ])
+        return chunks
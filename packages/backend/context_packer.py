@@ -0,0 +1,130 @@
+import re
+import threading
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r'\w+')
+
+
+def _shingles(text, size=3):
+    words = WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextPacker:
+    """
+    Fits the highest-ranked chunk documents into a prompt token budget.
+    Documents are taken in rank order, near-duplicates of an already packed
+    document are dropped, and the last document that does not fit whole is
+    truncated at a sentence boundary. Tokens are counted with tiktoken.
+    """
+
+    def __init__(self, token_budget=3000, encoding_name='cl100k_base',
+                 dedup_threshold=0.85, min_truncated_tokens=32):
+        self.token_budget = token_budget
+        self.encoding_name = encoding_name
+        self.dedup_threshold = dedup_threshold
+        self.min_truncated_tokens = min_truncated_tokens
+        self._encoding = None
+        self._encoding_failed = False
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.last_prompt_tokens = 0
+
+    def count(self, text):
+        """Number of tokens in text, approximated as 4 characters per token if tiktoken is unavailable"""
+        if self._encoding is None and not self._encoding_failed:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                print(f"tiktoken unavailable, approximating token counts: {e}")
+                self._encoding_failed = True
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def _truncate(self, doc, format_doc, budget):
+        """Keep whole leading sentences of the document text that fit within budget"""
+        overhead = self.count(format_doc({**doc, 'text': ''}))
+        available = budget - overhead
+        if available < self.min_truncated_tokens:
+            return None
+
+        kept = []
+        used = 0
+        for sentence in SENTENCE_BOUNDARY.split(doc.get('text', '')):
+            # +1 for the joining space
+            tokens = self.count(sentence) + (1 if kept else 0)
+            if used + tokens > available:
+                break
+            kept.append(sentence)
+            used += tokens
+
+        if not kept:
+            return None
+        return format_doc({**doc, 'text': ' '.join(kept)})
+
+    def pack(self, docs, format_doc):
+        """
+        Format and pack docs (in rank order) into the token budget.
+        Returns (contexts, stats).
+        """
+        contexts = []
+        kept_shingles = []
+        used = 0
+        duplicates = 0
+        truncated = 0
+
+        for doc in docs:
+            shingles = _shingles(doc.get('text', ''))
+            if any(
+                shingles and other and len(shingles & other) / len(shingles | other) >= self.dedup_threshold
+                for other in kept_shingles
+            ):
+                duplicates += 1
+                continue
+
+            context = format_doc(doc)
+            tokens = self.count(context) + 1  # +1 for the separator between contexts
+            if used + tokens > self.token_budget:
+                context = self._truncate(doc, format_doc, self.token_budget - used - 1)
+                if context is None:
+                    break
+                tokens = self.count(context) + 1
+                truncated += 1
+
+            contexts.append(context)
+            kept_shingles.append(shingles)
+            used += tokens
+            if used >= self.token_budget:
+                break
+
+        stats = {
+            'candidates': len(docs),
+            'packed': len(contexts),
+            'duplicates_dropped': duplicates,
+            'truncated': truncated,
+            'context_tokens': used
+        }
+        return contexts, stats
+
+    def record_prompt(self, prompt):
+        """Count and record the tokens of a prompt about to be sent"""
+        tokens = self.count(prompt)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += tokens
+            self.last_prompt_tokens = tokens
+        return tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'token_budget': self.token_budget,
+                'requests': self.requests,
+                'average_prompt_tokens': round(self.prompt_tokens / self.requests, 1) if self.requests else 0.0,
+                'last_prompt_tokens': self.last_prompt_tokens
+            }
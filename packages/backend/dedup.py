@@ -0,0 +1,149 @@
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+WORD = re.compile(r'\w+')
+PRIME = np.uint64(2 ** 31 - 1)
+
+
+def _pointer(chunk):
+    """Reference to a dropped duplicate kept on its representative"""
+    return {
+        'source': chunk['source'],
+        **{key: value for key, value in chunk['metadata'].items() if key != 'duplicates'}
+    }
+
+
+class ChunkDeduplicator:
+    """
+    Drops exact and near-duplicate chunks before they are embedded. Exact duplicates
+    are found by hashing the whitespace- and case-normalized text; near-duplicates by
+    MinHash signatures over word 3-grams, bucketed with LSH banding and confirmed when
+    the estimated Jaccard similarity reaches threshold.
+
+    Chunks are only compared within the same source file and label, so deleting or
+    re-ingesting one source never touches another source's representatives and label
+    filters stay exact. The first chunk seen is kept and collects a pointer to every
+    duplicate in metadata['duplicates']. State lives for one ingestion run, but only
+    the metadata and text_id of kept chunks outlive the batch they were written in,
+    never their text.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        rng = np.random.default_rng(seed)
+        # Universal hashes (a * x + b) mod p; products stay below 2^62
+        self._a = rng.integers(1, int(PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(PRIME), size=num_perm, dtype=np.uint64)
+        self._exact = {}  # (scope, text hash) -> representative
+        self._buckets = defaultdict(list)  # (scope, band, band hash) -> [representative index]
+        self._representatives = []  # [(representative, signature)]
+        self._pending = []  # [(representative, chunk)] kept by the last filter() call
+        self._late = {}  # id(representative) -> representative already written when it gained duplicates
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    @staticmethod
+    def _scope(chunk):
+        metadata = chunk['metadata']
+        return chunk['source'], metadata.get('filename', ''), metadata.get('label', '')
+
+    def _signature(self, text):
+        words = WORD.findall(text.lower())
+        if len(words) < 3:
+            return None
+        shingles = np.fromiter(
+            {zlib.crc32(' '.join(words[i:i + 3]).encode('utf-8')) for i in range(len(words) - 2)},
+            dtype=np.uint64
+        )
+        hashes = (shingles[:, None] % PRIME * self._a + self._b) % PRIME
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def _add_duplicate(self, representative, chunk):
+        representative['metadata'].setdefault('duplicates', []).append(_pointer(chunk))
+        if representative['text_id']:
+            self._late[id(representative)] = representative
+
+    def _release(self):
+        """
+        Keep only the text_id of the chunks kept by the last call, which have been written
+        by now, and drop the chunks themselves
+        """
+        for representative, chunk in self._pending:
+            representative['text_id'] = chunk.get('text_id')
+        self._pending = []
+
+    def filter(self, chunks):
+        """
+        Return the chunks that are not duplicates of a chunk seen earlier in the run.
+        Kept chunks are expected to be written, with their text_id set, before the next call.
+        """
+        self._release()
+        kept = []
+        rows = self.num_perm // self.bands
+        for chunk in chunks:
+            self.seen += 1
+            scope = self._scope(chunk)
+            normalized = ' '.join(chunk['text'].lower().split())
+            exact_key = (scope, hashlib.sha1(normalized.encode('utf-8')).digest())
+            representative = self._exact.get(exact_key)
+            if representative is not None:
+                self.exact_duplicates += 1
+                self._add_duplicate(representative, chunk)
+                continue
+
+            # The metadata dict is shared with the chunk, so pointers added before it is written are stored with it
+            representative = {'metadata': chunk['metadata'], 'text_id': None}
+            signature = self._signature(normalized)
+            if signature is not None:
+                band_keys = [
+                    (scope, band, signature[band * rows:(band + 1) * rows].tobytes())
+                    for band in range(self.bands)
+                ]
+                match = None
+                for position in {p for key in band_keys for p in self._buckets.get(key, ())}:
+                    candidate, candidate_signature = self._representatives[position]
+                    if np.mean(candidate_signature == signature) >= self.threshold:
+                        match = candidate
+                        break
+                if match is not None:
+                    self.near_duplicates += 1
+                    self._exact[exact_key] = match
+                    self._add_duplicate(match, chunk)
+                    continue
+                for key in band_keys:
+                    self._buckets[key].append(len(self._representatives))
+                self._representatives.append((representative, signature))
+
+            self._exact[exact_key] = representative
+            self._pending.append((representative, chunk))
+            kept.append(chunk)
+        return kept
+
+    def late_duplicates(self):
+        """
+        (text_id, duplicates) for representatives that gained duplicates after being
+        written, so their stored pointer lists can be brought up to date
+        """
+        late = [
+            (representative['text_id'], representative['metadata']['duplicates'])
+            for representative in self._late.values()
+        ]
+        self._late.clear()
+        return late
+
+    def stats(self):
+        return {
+            'chunks': self.seen,
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates,
+            'kept': self.seen - self.exact_duplicates - self.near_duplicates
+        }
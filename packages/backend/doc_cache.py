@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """
+    LRU cache of Firestore chunk documents keyed by company and text ID.
+    Invalidating a company bumps its generation, so its old entries can never be
+    returned again and simply age out of the LRU.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _key(self, company_id, text_id):
+        return (company_id, self._generations.get(company_id, 0), text_id)
+
+    def get_many(self, company_id, text_ids):
+        """Return {text_id: document} for the IDs that are cached"""
+        found = {}
+        with self._lock:
+            for text_id in text_ids:
+                key = self._key(company_id, text_id)
+                doc = self._entries.get(key)
+                if doc is not None:
+                    self._entries.move_to_end(key)
+                    found[text_id] = doc
+            self.hits += len(found)
+            self.misses += len(text_ids) - len(found)
+        return found
+
+    def put_many(self, company_id, docs):
+        with self._lock:
+            for text_id, doc in docs.items():
+                key = self._key(company_id, text_id)
+                self._entries[key] = doc
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, company_id):
+        with self._lock:
+            self._generations[company_id] = self._generations.get(company_id, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embeddings stored in SQLite.
+    Entries are keyed by a hash of the model name and the exact text that was
+    encoded, and the least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, path, model_name, max_entries=500_000):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, dim INTEGER, vector BLOB, last_used REAL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)'
+        )
+        self._conn.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts):
+        """Return a list aligned with texts holding cached embeddings or None"""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        now = time.time()
+
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})',
+                    batch
+                ).fetchall()
+                for key, dim, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32, count=dim)
+                if rows:
+                    self._conn.execute(
+                        f'UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})',
+                        [now] + batch
+                    )
+            self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(self, texts, embeddings):
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((self.key(text), len(vector), vector.tobytes(), now))
+
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE key IN '
+                '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'max_entries': self.max_entries
+            }
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class IngestionJob:
+    """State and per-stage progress of one background ingestion run"""
+
+    STAGES = ('blobs_extracted', 'chunks_embedded', 'vectors_upserted')
+
+    def __init__(self, company_id, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.company_id = company_id
+        self.status = 'queued'
+        self.progress = {stage: 0 for stage in self.STAGES}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._manager = None
+
+    def advance(self, stage, count=1):
+        """Record progress for a pipeline stage"""
+        with self._lock:
+            self.progress[stage] = self.progress.get(stage, 0) + count
+        if self._manager:
+            self._manager.save(self)
+
+    def to_dict(self):
+        with self._lock:
+            progress = dict(self.progress)
+
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            'job_id': self.id,
+            'company_id': self.company_id,
+            'status': self.status,
+            'progress': progress,
+            'throughput': {
+                f"{stage}_per_second": round(count / elapsed, 2) if elapsed else 0.0
+                for stage, count in progress.items()
+            },
+            'elapsed_seconds': round(elapsed, 2),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['company_id'], data['job_id'])
+        job.status = data['status']
+        job.progress.update(data.get('progress', {}))
+        job.created = data['created']
+        job.started = data.get('started')
+        job.finished = data.get('finished')
+        job.result = data.get('result')
+        job.error = data.get('error')
+        return job
+
+
+class JobManager:
+    """
+    Runs ingestion jobs on a local worker pool and persists their state as JSON
+    files under state_dir. Jobs for different companies run concurrently up to
+    max_concurrency, while a company can only have one active job at a time.
+    """
+
+    def __init__(self, state_dir, max_concurrency=2, save_interval=1.0):
+        self.state_dir = state_dir
+        self.save_interval = save_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='ingestion')
+        self._jobs = {}
+        self._last_saved = {}
+        self._lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _load(self):
+        """Reload persisted jobs; anything still active belonged to a process that died"""
+        for filename in os.listdir(self.state_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, filename)) as f:
+                    job = IngestionJob.from_dict(json.load(f))
+            except Exception as e:
+                print(f"Error loading job state {filename}: {e}")
+                continue
+            if job.status in ACTIVE_STATUSES:
+                job.status = 'interrupted'
+                job.error = 'Backend restarted before the job finished'
+                self.save(job, force=True)
+            self._jobs[job.id] = job
+
+    def save(self, job, force=False):
+        """Persist job state, throttled to save_interval unless forced"""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_saved.get(job.id, 0) < self.save_interval:
+                return
+            self._last_saved[job.id] = now
+            tmp_path = f"{self._path(job.id)}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, self._path(job.id))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(self, company_id, target, *args, **kwargs):
+        """
+        Queue target(*args, job=job, **kwargs) for a company.
+        Returns (job, created); created is False when the company already has an active job.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.company_id == company_id and job.status in ACTIVE_STATUSES:
+                    return job, False
+            job = IngestionJob(company_id)
+            job._manager = self
+            self._jobs[job.id] = job
+
+        self.save(job, force=True)
+        self._executor.submit(self._run, job, target, args, kwargs)
+        return job, True
+
+    def _run(self, job, target, args, kwargs):
+        job.status = 'running'
+        job.started = time.time()
+        self.save(job, force=True)
+        try:
+            job.result = target(*args, job=job, **kwargs)
+            job.status = 'completed'
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {e}")
+            print(traceback.format_exc())
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            self.save(job, force=True)
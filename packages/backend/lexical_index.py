@@ -0,0 +1,390 @@
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+from metadata_index import MetadataBitmapIndex
+
+try:
+    from nltk.stem import PorterStemmer
+    _stemmer = PorterStemmer()
+except ImportError:
+    _stemmer = None
+
+# Words joined by '-', '.', '/' or ':' stay together so codes like INV-2024-001 or 12.3(b) match exactly
+TOKEN = re.compile(r'\w+(?:[-./:]\w+)*')
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or that the '
+    'this to was were will with'.split()
+)
+
+
+@lru_cache(maxsize=100000)
+def _stem(word):
+    return _stemmer.stem(word) if _stemmer is not None else word
+
+
+def tokenize(text):
+    """
+    Lowercase terms of a text. Compound tokens are kept whole and also split into
+    their parts; purely alphabetic words are stemmed when NLTK is available.
+    """
+    terms = []
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if token.isalpha():
+            terms.append(_stem(token))
+            continue
+        terms.append(token)
+        parts = re.split(r'[-./:]', token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part and part not in STOPWORDS)
+    return terms
+
+
+class Segment:
+    """
+    Immutable block of the inverted index in CSR layout: the postings of term t are
+    doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies in tfs.
+    Deletions only flip the deleted mask.
+    """
+
+    def __init__(self, name, ids, metadatas, vocab, offsets, doc_ids, tfs, lengths, deleted=None):
+        self.name = name
+        self.ids = ids
+        self.metadatas = metadatas
+        self.metadata_index = MetadataBitmapIndex(metadatas)
+        self.vocab = vocab  # term -> row in offsets
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.lengths = lengths
+        self.deleted = deleted if deleted is not None else np.zeros(len(ids), dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, docs):
+        """Build a segment from (id, text, metadata) tuples"""
+        vocab = {}
+        term_ids, doc_ids, tfs = [], [], []
+        lengths = np.zeros(len(docs), dtype=np.uint32)
+        for position, (_, text, _) in enumerate(docs):
+            terms = tokenize(text)
+            lengths[position] = len(terms)
+            for term, tf in Counter(terms).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(position)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocab)))]).astype(np.int64)
+        return cls(
+            uuid.uuid4().hex,
+            [doc[0] for doc in docs],
+            [dict(doc[2] or {}) for doc in docs],
+            vocab,
+            offsets,
+            np.asarray(doc_ids, dtype=np.uint32)[order],
+            np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            lengths
+        )
+
+    @classmethod
+    def merge(cls, segments):
+        """Merge segments into one, dropping deleted documents"""
+        vocab = {}
+        ids, metadatas, lengths = [], [], []
+        term_parts, doc_parts, tf_parts = [], [], []
+        base = 0
+        for segment in segments:
+            live = ~np.asarray(segment.deleted)
+            doc_map = np.full(len(segment), -1, dtype=np.int64)
+            doc_map[live] = base + np.arange(int(live.sum()))
+            base += int(live.sum())
+            ids.extend(vec_id for vec_id, keep in zip(segment.ids, live) if keep)
+            metadatas.extend(metadata for metadata, keep in zip(segment.metadatas, live) if keep)
+            lengths.append(np.asarray(segment.lengths)[live])
+
+            term_map = np.empty(len(segment.vocab), dtype=np.int32)
+            for term, row in segment.vocab.items():
+                term_map[row] = vocab.setdefault(term, len(vocab))
+            posting_terms = np.repeat(term_map, np.diff(segment.offsets))
+            posting_docs = doc_map[np.asarray(segment.doc_ids)]
+            keep = posting_docs >= 0
+            term_parts.append(posting_terms[keep])
+            doc_parts.append(posting_docs[keep])
+            tf_parts.append(np.asarray(segment.tfs)[keep])
+
+        term_ids = np.concatenate(term_parts) if term_parts else np.zeros(0, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocab)))]).astype(np.int64)
+        return cls(
+            uuid.uuid4().hex,
+            ids,
+            metadatas,
+            vocab,
+            offsets,
+            np.concatenate(doc_parts).astype(np.uint32)[order] if doc_parts else np.zeros(0, dtype=np.uint32),
+            np.concatenate(tf_parts).astype(np.uint16)[order] if tf_parts else np.zeros(0, dtype=np.uint16),
+            np.concatenate(lengths).astype(np.uint32) if lengths else np.zeros(0, dtype=np.uint32)
+        )
+
+    def postings(self, term):
+        row = self.vocab.get(term)
+        if row is None:
+            return None, None
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'doc_ids.npy'), np.asarray(self.doc_ids))
+        np.save(os.path.join(path, 'tfs.npy'), np.asarray(self.tfs))
+        np.save(os.path.join(path, 'lengths.npy'), np.asarray(self.lengths))
+        terms = [None] * len(self.vocab)
+        for term, row in self.vocab.items():
+            terms[row] = term
+        with open(os.path.join(path, 'entries.json'), 'w') as f:
+            json.dump({'ids': self.ids, 'metadatas': self.metadatas, 'terms': terms}, f)
+
+    @classmethod
+    def load(cls, path, name, mmap=True):
+        with open(os.path.join(path, 'entries.json')) as f:
+            entries = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        return cls(
+            name,
+            entries['ids'],
+            entries['metadatas'],
+            {term: row for row, term in enumerate(entries['terms'])},
+            np.load(os.path.join(path, 'offsets.npy')),
+            np.load(os.path.join(path, 'doc_ids.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'tfs.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'lengths.npy'), mmap_mode=mmap_mode)
+        )
+
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk texts, stored as a list of immutable array-backed segments.
+    Each add() writes a new segment and segments are merged once there are more than
+    max_segments of them. Document frequencies count live documents only, like the
+    document total, so re-ingested terms keep their weight before the next merge.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, max_segments=8):
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.segments = []
+        self._totals = None
+
+    def __len__(self):
+        return self.totals()[0]
+
+    def totals(self):
+        """(live documents, live terms), cached until the index changes"""
+        if self._totals is None:
+            docs = terms = 0
+            for segment in self.segments:
+                live = ~segment.deleted
+                docs += int(live.sum())
+                terms += int(np.asarray(segment.lengths, dtype=np.int64)[live].sum())
+            self._totals = (docs, terms)
+        return self._totals
+
+    def copy(self):
+        index = BM25Index(self.k1, self.b, self.max_segments)
+        index.segments = [
+            Segment(s.name, s.ids, s.metadatas, s.vocab, s.offsets, s.doc_ids, s.tfs, s.lengths, s.deleted.copy())
+            for s in self.segments
+        ]
+        return index
+
+    def add(self, docs):
+        """Index (id, text, metadata) tuples, replacing any existing entries with the same ID"""
+        if not docs:
+            return self
+        self.remove([doc[0] for doc in docs])
+        self.segments.append(Segment.build(docs))
+        if len(self.segments) > self.max_segments:
+            self.segments = [Segment.merge(self.segments)]
+        self._totals = None
+        return self
+
+    def remove(self, ids):
+        ids = set(ids)
+        self._totals = None
+        for segment in self.segments:
+            for position, vec_id in enumerate(segment.ids):
+                if vec_id in ids:
+                    segment.deleted[position] = True
+        return self
+
+    def search(self, text, top_k, filter=None):
+        """
+        Return up to top_k (id, score, metadata) tuples ordered by BM25 score.
+        Documents failing the Pinecone-style metadata filter are never scored.
+        """
+        terms = list(dict.fromkeys(tokenize(text)))
+        live_docs, live_terms = self.totals()
+        if not terms or not live_docs or top_k <= 0:
+            return []
+
+        avgdl = max(live_terms / live_docs, 1.0)
+        idf = {}
+        for term in terms:
+            df = 0
+            for segment in self.segments:
+                doc_ids, _ = segment.postings(term)
+                if doc_ids is not None:
+                    df += len(doc_ids) - int(segment.deleted[doc_ids].sum())
+            if df:
+                idf[term] = np.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+
+        hits = []
+        for segment in self.segments:
+            excluded = segment.deleted
+            if filter:
+                excluded = excluded | ~segment.metadata_index.mask(filter)
+                if excluded.all():
+                    continue
+            scores = np.zeros(len(segment), dtype=np.float32)
+            for term, weight in idf.items():
+                doc_ids, tfs = segment.postings(term)
+                if doc_ids is None or not len(doc_ids):
+                    continue
+                if filter:
+                    allowed = ~excluded[doc_ids]
+                    doc_ids, tfs = doc_ids[allowed], tfs[allowed]
+                tfs = np.asarray(tfs, dtype=np.float32)
+                norm = self.k1 * (1 - self.b + self.b * np.asarray(segment.lengths)[doc_ids] / avgdl)
+                scores[doc_ids] += weight * tfs * (self.k1 + 1) / (tfs + norm)
+            scores[excluded] = 0
+            matched = np.flatnonzero(scores)
+            if not len(matched):
+                continue
+            k = min(top_k, len(matched))
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            hits.extend((float(scores[i]), segment.ids[i], segment.metadatas[i]) for i in top)
+
+        hits.sort(key=lambda hit: -hit[0])
+        return [(vec_id, score, metadata) for score, vec_id, metadata in hits[:top_k]]
+
+    def save(self, path):
+        """
+        Persist the index under path. Segments are immutable, so only new ones are
+        written; the segment list and deletions are swapped in through index.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for segment in self.segments:
+            segment_path = os.path.join(path, segment.name)
+            if not os.path.isdir(segment_path):
+                tmp_path = f"{segment_path}.tmp"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                segment.save(tmp_path)
+                os.replace(tmp_path, segment_path)
+
+        tmp_index = os.path.join(path, 'index.json.tmp')
+        with open(tmp_index, 'w') as f:
+            json.dump({
+                'k1': self.k1,
+                'b': self.b,
+                'max_segments': self.max_segments,
+                'segments': [
+                    {'name': segment.name, 'deleted': np.flatnonzero(segment.deleted).tolist()}
+                    for segment in self.segments
+                ]
+            }, f)
+        os.replace(tmp_index, os.path.join(path, 'index.json'))
+
+        # Segments merged away are no longer referenced
+        names = {segment.name for segment in self.segments}
+        for entry in os.listdir(path):
+            if entry not in names and entry != 'index.json':
+                shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'index.json')) as f:
+            entries = json.load(f)
+        index = cls(entries['k1'], entries['b'], entries['max_segments'])
+        for entry in entries['segments']:
+            segment = Segment.load(os.path.join(path, entry['name']), entry['name'], mmap)
+            segment.deleted[entry['deleted']] = True
+            index.segments.append(segment)
+        return index
+
+
+class LexicalIndexStore:
+    """Keeps one BM25Index per Pinecone namespace, persisted under snapshot_dir"""
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _path(self, namespace):
+        return os.path.join(self.snapshot_dir, namespace)
+
+    def load_all(self):
+        """Load every snapshot found on disk, returning the number of namespaces loaded"""
+        if not os.path.isdir(self.snapshot_dir):
+            return 0
+        loaded = 0
+        for namespace in os.listdir(self.snapshot_dir):
+            path = self._path(namespace)
+            if not os.path.exists(os.path.join(path, 'index.json')):
+                continue
+            try:
+                index = BM25Index.load(path)
+                with self._lock:
+                    self._indexes[namespace] = index
+                loaded += 1
+            except Exception as e:
+                print(f"Error loading lexical index {namespace}: {e}")
+        return loaded
+
+    def get(self, namespace):
+        with self._lock:
+            return self._indexes.get(namespace)
+
+    def _update(self, namespace, change):
+        # Queries keep using the previous index until the changed copy is published
+        with self._write_lock:
+            current = self.get(namespace)
+            index = current.copy() if current is not None else BM25Index()
+            change(index)
+            index.save(self._path(namespace))
+            with self._lock:
+                self._indexes[namespace] = index
+
+    def add(self, namespace, docs):
+        """Index (vector id, text, metadata) tuples for a namespace"""
+        if docs:
+            self._update(namespace, lambda index: index.add(docs))
+
+    def remove(self, namespace, ids):
+        if self.get(namespace) is not None:
+            self._update(namespace, lambda index: index.remove(ids))
+
+    def search(self, namespace, text, top_k, filter=None):
+        index = self.get(namespace)
+        return index.search(text, top_k, filter) if index is not None else []
+
+    def drop(self, namespace):
+        with self._lock:
+            self._indexes.pop(namespace, None)
+        shutil.rmtree(self._path(namespace), ignore_errors=True)
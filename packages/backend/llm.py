@@ -0,0 +1,58 @@
+import time
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Content:
+    def __init__(self, text):
+        self.parts = [_Part(text)]
+
+
+class _Candidate:
+    def __init__(self, text):
+        self.content = _Content(text)
+
+
+class FakeResponse:
+    """Mimics the parts of a Gemini response that the backend reads"""
+
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [_Candidate(text)]
+
+
+class FakeStreamingLLM:
+    """
+    Offline stand-in for genai.GenerativeModel. Returns a canned answer, or chart
+    JSON for chart prompts, and streams it word by word with an optional delay so
+    the streaming endpoint can be exercised without network access.
+    """
+
+    CHART_RESPONSE = (
+        '```json\n{"type": "bar", "data": {"labels": ["spam", "nonspam"], '
+        '"datasets": [{"label": "Messages", "data": [1, 2], '
+        '"backgroundColor": ["#FF6384", "#36A2EB"]}]}}\n```'
+    )
+
+    def __init__(self, answer=None, delay=0.0):
+        self.answer = answer or "This is a placeholder answer generated without calling Gemini."
+        self.delay = delay
+
+    def _text_for(self, prompt):
+        return self.CHART_RESPONSE if 'provide data that can be visualized as a chart' in prompt else self.answer
+
+    def _stream(self, text):
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            if self.delay:
+                time.sleep(self.delay)
+            yield FakeResponse(word if i == len(words) - 1 else word + ' ')
+
+    def generate_content(self, prompt, stream=False):
+        text = self._text_for(prompt)
+        if stream:
+            return self._stream(text)
+        return FakeResponse(text)
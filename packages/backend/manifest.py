@@ -0,0 +1,153 @@
+import hashlib
+from datetime import datetime
+
+# IDs stored per part document, well under Firestore's 1 MiB document limit
+PART_SIZE = 5000
+
+
+class IngestionManifest:
+    """
+    Records, per company, which version of every ingested source produced which
+    Firestore documents and vectors, so updates only reprocess what changed.
+    Entries live in the company-{id}-manifest collection, one document per source.
+    The IDs a source produced are kept in an 'ids' subcollection of its entry, in
+    parts of at most PART_SIZE IDs, so large sources never outgrow a document.
+    Vectors share their Firestore document's ID, so one list serves both.
+    """
+
+    def __init__(self, db, company_id):
+        self.collection = db.collection(f'company-{company_id}-manifest')
+        self.db = db
+        self._entries = None
+
+    @staticmethod
+    def doc_id(name):
+        # Blob names may contain '/', which Firestore does not allow in document IDs
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def _parts(self, name):
+        return self.collection.document(self.doc_id(name)).collection('ids')
+
+    def load(self):
+        """Return {source name: entry} for everything ingested so far"""
+        if self._entries is None:
+            self._entries = {}
+            for doc in self.collection.stream():
+                entry = doc.to_dict()
+                if entry and 'name' in entry:
+                    self._entries[entry['name']] = entry
+        return self._entries
+
+    def diff(self, sources, prefix=None, local_names=()):
+        """
+        Compare current sources ({'name', 'generation', 'md5'} dictionaries) with the manifest.
+        Returns (changed, removed): sources that are new, modified or only partly stored,
+        and manifest entries whose source has changed or disappeared and must have their
+        embeddings deleted. A partly stored entry of the current version is resumed, not
+        deleted. With a prefix, only blob entries under that prefix can be considered removed;
+        local_names lists the sources that are not blobs, such as the email file.
+        """
+        entries = self.load()
+        current_names = set()
+        changed = []
+        stale = []
+
+        for source in sources:
+            current_names.add(source['name'])
+            entry = entries.get(source['name'])
+            if entry is None:
+                changed.append(source)
+            elif (entry.get('generation'), entry.get('md5')) != (source['generation'], source['md5']):
+                changed.append(source)
+                stale.append(entry)
+            elif not entry.get('complete', True):
+                changed.append(source)
+
+        removed = [
+            entry for name, entry in entries.items()
+            if name not in current_names and (prefix is None or (name.startswith(prefix) and name not in local_names))
+        ]
+        return changed, stale + removed
+
+    def _entry(self, source, complete):
+        return {
+            'name': source['name'],
+            'generation': source['generation'],
+            'md5': source['md5'],
+            'complete': complete,
+            'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def _commit(self, operations):
+        """Apply (reference, data) operations in batches; data None deletes the document"""
+        batch = self.db.batch()
+        pending = 0
+        for reference, data in operations:
+            if data is None:
+                batch.delete(reference)
+            else:
+                batch.set(reference, data)
+            pending += 1
+            if pending >= 400:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+
+    def record(self, sources, ids_by_name):
+        """Store the new version of each source with the IDs it produced"""
+        entries = self.load()
+
+        def operations():
+            for source in sources:
+                ids = ids_by_name.get(source['name'], [])
+                for part, start in enumerate(range(0, len(ids), PART_SIZE)):
+                    yield self._parts(source['name']).document(f"{part:012d}"), {'ids': ids[start:start + PART_SIZE]}
+                entry = self._entry(source, complete=True)
+                entries[source['name']] = entry
+                yield self.collection.document(self.doc_id(source['name'])), entry
+
+        self._commit(operations())
+
+    def begin(self, source):
+        """Mark a streamed source as partly stored until complete() is called"""
+        entry = self._entry(source, complete=False)
+        self.collection.document(self.doc_id(source['name'])).set(entry)
+        self.load()[source['name']] = entry
+
+    def append_ids(self, source, part, ids):
+        """
+        Record the IDs of one stored batch of a streamed source. part identifies the
+        batch, so a batch stored again after a crash overwrites its earlier record.
+        """
+        self._parts(source['name']).document(f"{part:012d}").set({'ids': ids})
+
+    def complete(self, source):
+        entry = self._entry(source, complete=True)
+        self.collection.document(self.doc_id(source['name'])).set(entry)
+        self.load()[source['name']] = entry
+
+    def iter_ids(self, entry):
+        """
+        Yield (text_ids, vector_ids) lists for an entry, one part at a time. Entries
+        written before IDs moved to parts keep them inline, with separate vector IDs.
+        """
+        if entry.get('text_ids') or entry.get('vector_ids'):
+            yield entry.get('text_ids', []), entry.get('vector_ids', [])
+        for doc in self._parts(entry['name']).stream():
+            ids = (doc.to_dict() or {}).get('ids', [])
+            yield ids, ids
+
+    def remove(self, names):
+        """Forget sources, together with their recorded IDs"""
+        entries = self.load()
+
+        def operations():
+            for name in names:
+                for doc in self._parts(name).stream():
+                    yield doc.reference, None
+                yield self.collection.document(self.doc_id(name)), None
+                entries.pop(name, None)
+
+        self._commit(operations())
@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+
+CATEGORICAL_OPERATORS = ('$eq', '$ne', '$in', '$nin')
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+
+
+def validate_filter(metadata_filter):
+    """Raise ValueError unless the filter only uses the Pinecone operators supported locally"""
+    if not isinstance(metadata_filter, dict):
+        raise ValueError("Filter must be an object")
+    for field, condition in metadata_filter.items():
+        if not isinstance(condition, dict):
+            continue
+        for operator in condition:
+            if operator not in CATEGORICAL_OPERATORS + RANGE_OPERATORS:
+                raise ValueError(f"Unsupported filter operator {operator} on {field}")
+
+
+class MetadataBitmapIndex:
+    """
+    Columnar view of vector metadata that evaluates Pinecone-style filters
+    ({field: value} or {field: {operator: operand}}, fields ANDed together) into a
+    boolean mask over the rows. Columns are built lazily the first time a field is
+    filtered on: categorical fields as int32 codes, range fields as float64.
+    """
+
+    def __init__(self, metadatas):
+        self.metadatas = metadatas
+        self._codes = {}
+        self._numbers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.metadatas)
+
+    def _categorical(self, field):
+        with self._lock:
+            column = self._codes.get(field)
+            if column is None:
+                lookup = {}
+                codes = np.fromiter(
+                    (lookup.setdefault(metadata.get(field), len(lookup)) for metadata in self.metadatas),
+                    dtype=np.int32, count=len(self.metadatas)
+                )
+                column = self._codes[field] = (codes, lookup)
+            return column
+
+    def _numeric(self, field):
+        with self._lock:
+            column = self._numbers.get(field)
+            if column is None:
+                column = np.full(len(self.metadatas), np.nan)
+                for row, metadata in enumerate(self.metadatas):
+                    value = metadata.get(field)
+                    if isinstance(value, (int, float)):
+                        column[row] = value
+                self._numbers[field] = column
+            return column
+
+    def mask(self, metadata_filter):
+        """Boolean array marking the rows that satisfy the filter"""
+        mask = np.ones(len(self.metadatas), dtype=bool)
+        for field, condition in metadata_filter.items():
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                if operator in CATEGORICAL_OPERATORS:
+                    codes, lookup = self._categorical(field)
+                    values = operand if isinstance(operand, (list, tuple)) else [operand]
+                    matches = np.isin(codes, [lookup[value] for value in values if value in lookup])
+                    mask &= ~matches if operator in ('$ne', '$nin') else matches
+                elif operator in RANGE_OPERATORS:
+                    column = self._numeric(field)
+                    with np.errstate(invalid='ignore'):
+                        if operator == '$gt':
+                            mask &= column > operand
+                        elif operator == '$gte':
+                            mask &= column >= operand
+                        elif operator == '$lt':
+                            mask &= column < operand
+                        else:
+                            mask &= column <= operand
+                else:
+                    raise ValueError(f"Unsupported filter operator {operator} on {field}")
+        return mask
@@ -0,0 +1,125 @@
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def resident_memory_mb():
+    """Current resident set size of this process in megabytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        # No /proc (e.g. macOS): fall back to the peak RSS, reported in bytes there
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class ModelRegistry:
+    """
+    Loads models on first use instead of at import time.
+    Each model declares the deployment roles that may load it, so a query-serving
+    replica never pays for OCR or Whisper. Models unused for idle_timeout seconds
+    can be unloaded by a background reaper and are transparently reloaded later.
+    """
+
+    ROLES = ('query', 'ingestion', 'all')
+
+    def __init__(self, role='all', idle_timeout=0):
+        if role not in self.ROLES:
+            raise ValueError(f"Unknown backend role: {role}")
+        self.role = role
+        self.idle_timeout = idle_timeout
+        self._specs = {}
+        self._models = {}
+        self._last_used = {}
+        self._load_seconds = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def register(self, name, loader, roles):
+        self._specs[name] = (loader, tuple(roles))
+        self._locks[name] = threading.Lock()
+
+    def allowed(self, name):
+        _, roles = self._specs[name]
+        return self.role == 'all' or self.role in roles
+
+    def get(self, name):
+        """Return the named model, loading it on first use (thread-safe)"""
+        if name not in self._specs:
+            raise KeyError(f"Unknown model: {name}")
+        if not self.allowed(name):
+            raise RuntimeError(f"Model '{name}' is not available for the '{self.role}' role")
+
+        with self._lock:
+            model = self._models.get(name)
+            self._last_used[name] = time.time()
+        if model is not None:
+            return model
+
+        # Per-model lock so one slow load does not block the others
+        with self._locks[name]:
+            with self._lock:
+                model = self._models.get(name)
+            if model is None:
+                start = time.time()
+                model = self._specs[name][0]()
+                elapsed = time.time() - start
+                with self._lock:
+                    self._models[name] = model
+                    self._load_seconds[name] = elapsed
+                    self._last_used[name] = time.time()
+                print(f"Loaded model '{name}' in {elapsed:.1f}s, resident memory {resident_memory_mb():.0f} MB")
+        return model
+
+    def preload(self):
+        """Load every model the current role is allowed to use"""
+        for name in self._specs:
+            if self.allowed(name):
+                self.get(name)
+
+    def unload_idle(self):
+        """Drop models that have not been used within idle_timeout seconds"""
+        if not self.idle_timeout:
+            return []
+        now = time.time()
+        unloaded = []
+        with self._lock:
+            for name in list(self._models):
+                if now - self._last_used.get(name, now) > self.idle_timeout:
+                    del self._models[name]
+                    unloaded.append(name)
+        if unloaded:
+            gc.collect()
+            print(f"Unloaded idle models: {', '.join(unloaded)}")
+        return unloaded
+
+    def start_reaper(self, interval=60):
+        """Periodically unload idle models in a daemon thread"""
+        if not self.idle_timeout or self._reaper is not None:
+            return
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.unload_idle()
+                except Exception as e:
+                    print(f"Error unloading idle models: {e}")
+
+        self._reaper = threading.Thread(target=reap, name='model-reaper', daemon=True)
+        self._reaper.start()
+
+    def status(self):
+        with self._lock:
+            return {
+                'role': self.role,
+                'loaded': sorted(self._models),
+                'available': sorted(name for name in self._specs if self.allowed(name)),
+                'load_seconds': {name: round(seconds, 2) for name, seconds in self._load_seconds.items()}
+            }
@@ -0,0 +1,295 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def image_digest(source):
+    """SHA-256 of image bytes or of a local image file"""
+    digest = hashlib.sha256()
+    if isinstance(source, bytes):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def decode_image(source, max_side=0):
+    """
+    Decode image bytes or a local image file into the (RGB, greyscale) arrays EasyOCR
+    works on, downscaled so the longer side is at most max_side pixels (0 keeps the
+    full resolution). Returns None when the image cannot be decoded.
+    """
+    # Imported here so processes that never run OCR do not load OpenCV
+    import cv2
+
+    data = np.frombuffer(source, np.uint8) if isinstance(source, bytes) else np.fromfile(source, np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    height, width = image.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        image = cv2.resize(image, (max(round(width * scale), 1), max(round(height * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class OcrCache:
+    """
+    Persistent cache of OCR text stored in SQLite, keyed by the SHA-256 of the image
+    content. The least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, path, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT, last_used REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr(last_used)')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT text FROM ocr WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._conn.execute('UPDATE ocr SET last_used = ? WHERE key = ?', (time.time(), key))
+                self._conn.commit()
+        return row[0] if row is not None else None
+
+    def put(self, key, text):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ocr (key, text, last_used) VALUES (?, ?, ?)', (key, text, time.time())
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM ocr').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM ocr WHERE key IN (SELECT key FROM ocr ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+
+class OcrStats:
+    """Counts OCR work, either of the whole worker or of the images of one ingestion run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'images': 0, 'cache_hits': 0, 'undecodable': 0, 'no_text': 0,
+            'batches': 0, 'detect_calls': 0, 'seconds': 0.0
+        }
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def to_dict(self):
+        with self._lock:
+            stats = dict(self._counts)
+        read = stats['images'] - stats['cache_hits'] - stats['undecodable']
+        stats['images_per_second'] = read / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+
+class OcrJob:
+    """
+    An image ready for the OCR worker: its content key, either cached text or decoded
+    arrays, and the OcrStats of the run it belongs to, if any
+    """
+
+    def __init__(self, key, text=None, image=None, stats=None):
+        self.key = key
+        self.text = text
+        self.image = image
+        self.stats = stats
+
+
+def _runs(jobs):
+    """The distinct run counters of jobs, each with how many of the jobs it owns"""
+    runs = {}
+    for job in jobs:
+        if job.stats is not None:
+            stats, count = runs.get(id(job.stats), (job.stats, 0))
+            runs[id(job.stats)] = (stats, count + 1)
+    return runs.values()
+
+
+def letterbox(images):
+    """
+    Pad RGB images to one shared canvas, each in the top-left corner, so they can be
+    detected in a single batch while text boxes keep the coordinates of the original
+    """
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    canvas = np.zeros((len(images), height, width, 3), dtype=np.uint8)
+    for position, image in enumerate(images):
+        canvas[position, :image.shape[0], :image.shape[1]] = image
+    return canvas
+
+
+class BatchedOcrWorker:
+    """
+    Runs EasyOCR on a single thread in batches. Images submitted within max_wait
+    seconds of each other are grouped, letterboxed to a shared canvas and detected in
+    one call, and recognition is skipped for images where nothing was detected. Images
+    only share a canvas while padding stays under max_padding of it and the batch stays
+    under max_batch_pixels, so mixed sizes do not waste detection time or memory. Results are cached by image content, so a re-uploaded image is never
+    read twice.
+
+    prepare() hashes and decodes an image and is meant to run on the caller's I/O
+    threads, so decoding and downscaling happen in parallel outside the worker.
+    stats() covers everything the worker has read; pass an OcrStats to prepare() to
+    count one run's images, which get a share of the batches they were read in.
+    """
+
+    def __init__(self, get_reader, batch_size=8, max_wait=0.05, max_side=1600, recognize_batch_size=32,
+                 cache=None, max_padding=0.25, max_batch_pixels=8_000_000):
+        self.get_reader = get_reader
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_side = max_side
+        self.recognize_batch_size = recognize_batch_size
+        self.cache = cache
+        self.max_padding = max_padding
+        self.max_batch_pixels = max_batch_pixels
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = OcrStats()
+
+    def _count(self, name, stats=None):
+        self._stats.count(name)
+        if stats is not None:
+            stats.count(name)
+
+    def prepare(self, source, stats=None):
+        """Hash an image and, unless its text is cached, decode and downscale it"""
+        key = image_digest(source)
+        self._count('images', stats)
+        text = self.cache.get(key) if self.cache else None
+        if text is not None:
+            self._count('cache_hits', stats)
+            return OcrJob(key, text=text, stats=stats)
+
+        image = decode_image(source, self.max_side)
+        if image is None:
+            self._count('undecodable', stats)
+            return OcrJob(key, text='', stats=stats)
+        return OcrJob(key, image=image, stats=stats)
+
+    def submit(self, job):
+        """Return a future resolving to the text of a prepared image"""
+        future = Future()
+        if job.text is not None:
+            future.set_result(job.text)
+            return future
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ocr', daemon=True)
+                self._thread.start()
+        self._queue.put((job, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            try:
+                self._read_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            elapsed = time.perf_counter() - started
+            self._stats.count('batches')
+            self._stats.count('seconds', elapsed)
+            for stats, count in _runs([job for job, _ in batch]):
+                stats.count('batches')
+                stats.count('seconds', elapsed * count / len(batch))
+
+    def _detect_groups(self, batch):
+        """Split a batch into groups that can share a detection canvas"""
+        def area(item):
+            height, width = item[0].image[0].shape[:2]
+            return height * width
+
+        groups = []
+        for item in sorted(batch, key=area, reverse=True):
+            height, width = item[0].image[0].shape[:2]
+            for group in groups:
+                canvas = max(height, group['height']) * max(width, group['width'])
+                fits = (
+                    canvas * (len(group['items']) + 1) <= self.max_batch_pixels
+                    and min(area(item), group['smallest']) >= (1 - self.max_padding) * canvas
+                )
+                if fits:
+                    group['items'].append(item)
+                    group['height'] = max(height, group['height'])
+                    group['width'] = max(width, group['width'])
+                    group['smallest'] = min(area(item), group['smallest'])
+                    break
+            else:
+                groups.append({'items': [item], 'height': height, 'width': width, 'smallest': area(item)})
+        return [group['items'] for group in groups]
+
+    def _read_batch(self, batch):
+        reader = self.get_reader()
+
+        for group in self._detect_groups(batch):
+            rgb = letterbox([job.image[0] for job, _ in group])
+            horizontal_lists, free_lists = reader.detect(rgb, reformat=False)
+            self._stats.count('detect_calls')
+            for stats, _ in _runs([job for job, _ in group]):
+                stats.count('detect_calls')
+
+            for (job, future), horizontal, free in zip(group, horizontal_lists, free_lists):
+                try:
+                    if not horizontal and not free:
+                        # Nothing detected, so there is nothing to recognize
+                        self._count('no_text', job.stats)
+                        text = ''
+                    else:
+                        results = reader.recognize(
+                            job.image[1], horizontal, free, batch_size=self.recognize_batch_size, reformat=False
+                        )
+                        text = ' '.join(result[1] for result in results)
+                    if self.cache:
+                        self.cache.put(job.key, text)
+                    future.set_result(text)
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    job.image = None
+
+    def stats(self):
+        return self._stats.to_dict()
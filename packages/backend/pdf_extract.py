@@ -0,0 +1,121 @@
+import io
+import re
+import sys
+import threading
+from concurrent.futures import Future
+
+import PyPDF2
+
+# Spaces PDF extraction leaves before punctuation
+SPACE_BEFORE_PUNCTUATION = re.compile(r' ([,.:])')
+
+_non_printable = None
+_non_printable_lock = threading.Lock()
+
+
+def non_printable_pattern():
+    """
+    Regex matching every character str.isprintable rejects except newlines.
+    Built on first use, since most pages never need it.
+    """
+    global _non_printable
+    with _non_printable_lock:
+        if _non_printable is None:
+            ranges = []
+            start = None
+            for code in range(sys.maxunicode + 2):
+                excluded = code <= sys.maxunicode and code != 10 and not chr(code).isprintable()
+                if excluded and start is None:
+                    start = code
+                elif not excluded and start is not None:
+                    ranges.append(f'\\U{start:08x}-\\U{code - 1:08x}')
+                    start = None
+            _non_printable = re.compile(f"[{''.join(ranges)}]")
+        return _non_printable
+
+
+def clean_text(text):
+    """Clean extracted text by removing excessive whitespace and newlines."""
+    if not text:
+        return ""
+
+    # Replace multiple newlines and spaces with a single space
+    text = ' '.join(text.split())
+
+    # Fix common PDF extraction artifacts
+    text = SPACE_BEFORE_PUNCTUATION.sub(r'\1', text)
+    text = text.replace('●', '\n•')  # Convert bullets to cleaner format
+
+    # Remove any remaining control characters; whitespace is already collapsed, so
+    # one C-level check clears almost every page without touching the regex
+    if not text.replace('\n', '').isprintable():
+        text = non_printable_pattern().sub('', text)
+
+    return text.strip()
+
+
+def open_pdf(source):
+    return PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def count_pdf_pages(source):
+    """Number of pages in a PDF, given its bytes or a file path"""
+    return len(open_pdf(source).pages)
+
+
+def extract_pdf_pages(source, start=0, stop=None):
+    """
+    Extract and clean pages [start, stop) of a PDF, given its bytes or a file path.
+    Returns (page number counted from 1, text) pairs, skipping pages without text.
+    Kept free of app state so it can run in a worker process.
+    """
+    pdf_reader = open_pdf(source)
+    stop = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+    pages = []
+
+    for page_index in range(start, stop):
+        cleaned_text = clean_text(pdf_reader.pages[page_index].extract_text())
+        if cleaned_text:
+            pages.append((page_index + 1, cleaned_text))
+
+    return pages
+
+
+def extract_pdf_text(source):
+    """Extract and clean the text of every page in a PDF, given its bytes or a file path."""
+    return '\n\n'.join(text for _, text in extract_pdf_pages(source))
+
+
+def submit_pdf_pages(executor, source, page_count, pages_per_task):
+    """
+    Fan a PDF out across executor in ranges of pages_per_task pages. Returns a future
+    resolving to the (page number, text) pairs of the whole document in page order.
+    source is sent to every task, so pass a file path when there is more than one range.
+    """
+    result = Future()
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    if not ranges:
+        result.set_result([])
+        return result
+
+    parts = [None] * len(ranges)
+    remaining = [len(ranges)]
+    lock = threading.Lock()
+
+    def on_done(position, future):
+        with lock:
+            if result.done():
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            parts[position] = future.result()
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        result.set_result([page for part in parts for page in part])
+
+    for position, (start, stop) in enumerate(ranges):
+        task = executor.submit(extract_pdf_pages, source, start, stop)
+        task.add_done_callback(lambda f, p=position: on_done(p, f))
+    return result
@@ -0,0 +1,37 @@
+import numpy as np
+
+QUANTIZATION_KINDS = ('none', 'int8', 'float16')
+
+
+def quantize(vectors, kind):
+    """
+    Compress float32 vectors row by row. int8 stores each row scaled by its own
+    max-abs value (the scale is kept as float32); float16 needs no scale.
+    Returns (codes, scales) with scales None for float16.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if kind == 'float16':
+        return vectors.astype(np.float16), None
+    if kind == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+        scales = scales.astype(np.float32)
+        safe = np.where(scales == 0, 1.0, scales)
+        codes = np.clip(np.rint(vectors / safe[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"Unknown quantization: {kind}")
+
+
+def approximate_scores(codes, scales, query, rows=None, block_size=8192):
+    """
+    Inner products of query with the quantized rows (all rows when rows is None).
+    Rows are decoded in blocks so the float32 working set stays bounded.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    total = len(codes) if rows is None else len(rows)
+    scores = np.empty(total, dtype=np.float32)
+    for start in range(0, total, block_size):
+        block = slice(start, start + block_size) if rows is None else rows[start:start + block_size]
+        scores[start:start + block_size] = codes[block].astype(np.float32) @ query
+        if scales is not None:
+            scores[start:start + block_size] *= scales[block]
+    return scores
@@ -0,0 +1,132 @@
+import csv
+import json
+import os
+
+DEFAULT_COLUMN_MAP = {'label': 0, 'message': 1}
+
+
+def parse_column_map(spec):
+    """
+    Parse a column mapping such as '{"label": "v1", "message": "v2"}'. Values are header
+    names or keys, or zero-based column indexes for CSV files.
+    """
+    if not spec:
+        return dict(DEFAULT_COLUMN_MAP)
+    column_map = json.loads(spec)
+    if not isinstance(column_map, dict) or 'message' not in column_map:
+        raise ValueError("Column map must be an object with at least a 'message' column")
+    return column_map
+
+
+def _csv_rows(file, column_map):
+    reader = csv.reader(file)
+    header = next(reader, None) or []
+    positions = {}
+    for field, column in column_map.items():
+        if isinstance(column, int):
+            positions[field] = column
+        elif column in header:
+            positions[field] = header.index(column)
+        else:
+            raise ValueError(f"Column '{column}' not found in CSV header")
+
+    for row in reader:
+        yield {
+            field: row[position] if position < len(row) else None
+            for field, position in positions.items()
+        }
+
+
+def _jsonl_rows(file, column_map):
+    # Column indexes only make sense for CSV, so JSONL falls back to the field names
+    keys = {field: field if isinstance(column, int) else column for field, column in column_map.items()}
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            yield None
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            print(f"Skipping malformed JSONL line {line_number}")
+            yield None
+            continue
+        yield {field: record.get(key) for field, key in keys.items()} if isinstance(record, dict) else None
+
+
+def iter_record_batches(path, column_map=None, batch_size=500, start_row=0, encoding=None):
+    """
+    Stream a CSV or JSONL file as batches of {'label', 'message', 'row', ...} records,
+    holding at most one batch in memory. Rows before start_row are skipped without
+    being mapped. Yields (next_row, records) where next_row is the row to resume from
+    once the batch is stored. Without an encoding, JSONL is read as UTF-8, as JSON
+    requires, and CSV as ISO-8859-1.
+    """
+    column_map = column_map or DEFAULT_COLUMN_MAP
+    is_jsonl = os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson')
+    encoding = encoding or ('utf-8' if is_jsonl else 'ISO-8859-1')
+    batch = []
+    row_number = 0
+
+    with open(path, 'r', encoding=encoding, newline='' if not is_jsonl else None) as file:
+        rows = _jsonl_rows(file, column_map) if is_jsonl else _csv_rows(file, column_map)
+        for row_number, row in enumerate(rows):
+            if row_number < start_row or row is None:
+                continue
+            message = row.get('message')
+            if not isinstance(message, str) or not message.strip():  # Skip empty rows
+                continue
+            record = {field: value.strip() if isinstance(value, str) else value for field, value in row.items()}
+            record['label'] = str(record.get('label') or 'unknown').lower()
+            record['row'] = row_number
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield row_number + 1, batch
+                batch = []
+
+    if batch:
+        yield row_number + 1, batch
+
+
+class IngestionCheckpoint:
+    """
+    Append-only progress log for streamed sources of one company. Every stored batch
+    appends a line with the source version and the row to resume from, so a crashed
+    run can continue where it stopped. The IDs each batch produced are recorded in
+    the ingestion manifest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def resume(self, name, version):
+        """Return the row to resume this version of the source from"""
+        start_row = 0
+        if not os.path.exists(self.path):
+            return start_row
+        with open(self.path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line means that batch was never recorded; drop it so appends stay parseable
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                if entry['name'] == name and entry['version'] == version:
+                    start_row = entry['row']
+        return start_row
+
+    def append(self, name, version, row):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'name': name, 'version': version, 'row': row}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,198 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from metadata_index import MetadataBitmapIndex
+
+
+def _normalize_match(match):
+    """Convert a Pinecone match (object or dict) into a plain dictionary"""
+    if isinstance(match, dict):
+        return {
+            'id': match.get('id'),
+            'score': float(match.get('score', 0.0)),
+            'metadata': dict(match.get('metadata') or {})
+        }
+    return {
+        'id': match.id,
+        'score': float(match.score),
+        'metadata': dict(match.metadata or {})
+    }
+
+
+class PineconeRetriever:
+    """Runs top-k retrieval server side with a single Pinecone query per request"""
+
+    name = 'pinecone'
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors, namespace):
+        for start in range(0, len(vectors), 100):  # Keep requests under Pinecone's size limit
+            self.index.upsert(vectors=vectors[start:start + 100], namespace=namespace)
+
+    def delete(self, ids, namespace):
+        ids = list(ids)
+        for start in range(0, len(ids), 1000):  # Pinecone caps IDs per delete request
+            self.index.delete(ids=ids[start:start + 1000], namespace=namespace)
+
+    def clear(self, namespace):
+        self.index.delete(delete_all=True, namespace=namespace)
+
+    def query(self, vector, namespace, top_k, filter=None):
+        # Pinecone applies the metadata filter inside the index
+        kwargs = {'filter': filter} if filter else {}
+        response = self.index.query(
+            vector=list(vector),
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=True,
+            include_values=False,
+            **kwargs
+        )
+        matches = response['matches'] if isinstance(response, dict) else response.matches
+        return [_normalize_match(match) for match in matches]
+
+
+class LocalRetriever:
+    """
+    In-process stand-in for Pinecone, used for offline development and testing.
+    Vectors are kept per namespace and scored with brute-force cosine similarity.
+    A namespace's matrix and metadata bitmaps are rebuilt on the first query after
+    a write and reused until the next one.
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._namespaces = defaultdict(dict)
+        self._snapshots = {}
+
+    def upsert(self, vectors, namespace):
+        with self._lock:
+            store = self._namespaces[namespace]
+            for vector in vectors:
+                store[vector['id']] = (
+                    np.asarray(vector['values'], dtype=np.float32),
+                    dict(vector.get('metadata') or {})
+                )
+            self._snapshots.pop(namespace, None)
+
+    def delete(self, ids, namespace):
+        with self._lock:
+            store = self._namespaces.get(namespace, {})
+            for vec_id in ids:
+                store.pop(vec_id, None)
+            self._snapshots.pop(namespace, None)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            self._snapshots.pop(namespace, None)
+
+    def _snapshot(self, namespace):
+        with self._lock:
+            snapshot = self._snapshots.get(namespace)
+            if snapshot is None:
+                items = list(self._namespaces.get(namespace, {}).items())
+                if not items:
+                    return None
+                metadatas = [metadata for _, (_, metadata) in items]
+                snapshot = self._snapshots[namespace] = (
+                    [vec_id for vec_id, _ in items],
+                    np.vstack([values for _, (values, _) in items]),
+                    metadatas,
+                    MetadataBitmapIndex(metadatas)
+                )
+            return snapshot
+
+    def query(self, vector, namespace, top_k, filter=None):
+        snapshot = self._snapshot(namespace)
+        if snapshot is None or top_k <= 0:
+            return []
+
+        ids, matrix, metadatas, metadata_index = snapshot
+        rows = np.flatnonzero(metadata_index.mask(filter)) if filter else np.arange(len(ids))
+        if not len(rows):
+            return []
+        matrix = matrix[rows] if filter else matrix
+        query = np.asarray(vector, dtype=np.float32)
+
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        norms[norms == 0] = 1.0
+        scores = matrix @ query / norms
+
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {
+                'id': ids[rows[i]],
+                'score': float(scores[i]),
+                'metadata': dict(metadatas[rows[i]])
+            }
+            for i in top
+        ]
+
+
+class AnnRetriever:
+    """
+    Serves queries from the in-process ANN index of a namespace when one holding the
+    whole namespace has been built or loaded, and falls back to another retriever for
+    everything else, including namespaces ingested before the ANN backend was enabled.
+    """
+
+    name = 'ann'
+
+    def __init__(self, ann_store, fallback):
+        self.ann_store = ann_store
+        self.fallback = fallback
+
+    def upsert(self, vectors, namespace):
+        # The remote index stays the durable copy; the ANN index is populated after embedding
+        self.fallback.upsert(vectors, namespace)
+
+    def delete(self, ids, namespace):
+        self.fallback.delete(ids, namespace)
+        self.ann_store.remove(namespace, ids)
+
+    def clear(self, namespace):
+        self.fallback.clear(namespace)
+        self.ann_store.drop(namespace)
+
+    def query(self, vector, namespace, top_k, nprobe=None, filter=None):
+        ann_index = self.ann_store.get(namespace)
+        if ann_index is None or not ann_index.complete or not len(ann_index):
+            return self.fallback.query(vector, namespace, top_k, filter=filter)
+        return [
+            {'id': vec_id, 'score': score, 'metadata': dict(metadata)}
+            for vec_id, score, metadata in ann_index.search(vector, top_k, nprobe=nprobe, filter=filter)
+        ]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked lists of IDs with reciprocal rank fusion.
+    Returns [(id, fused score)] ordered by fused score.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def create_retriever(backend, index=None, ann_store=None):
+    """Create the retrieval engine configured by RETRIEVAL_BACKEND"""
+    backend = (backend or 'pinecone').lower()
+    if backend == 'pinecone':
+        return PineconeRetriever(index)
+    if backend == 'local':
+        return LocalRetriever()
+    if backend == 'ann':
+        return AnnRetriever(ann_store, PineconeRetriever(index))
+    raise ValueError(f"Unknown retrieval backend: {backend}")
@@ -0,0 +1,21 @@
+from chunker import TokenChunker
+
+
+def test_boundary_followed_by_long_sentence():
+    prose = ' '.join(f"Sentence number {i} is some prose." for i in range(20))
+    table = ' '.join(f"w{i}" for i in range(400))
+    chunker = TokenChunker(max_tokens=238, overlap=32)
+
+    chunks = chunker.split([f"{prose} {table}"])[0]
+
+    assert len(chunks) == 3
+    assert chunks[0] == prose
+    assert all(len(chunk.split()) <= 238 for chunk in chunks)
+    # Every chunk moves past the end of the one before it instead of repeating its tail
+    assert chunks[-1].endswith('w399')
+    assert not any(chunks[0].endswith(chunk) for chunk in chunks[1:])
+
+
+def test_short_text_is_one_chunk():
+    chunker = TokenChunker(max_tokens=238, overlap=32)
+    assert chunker.split(["One sentence. Another one."]) == [["One sentence. Another one."]]